@@ -0,0 +1,1236 @@
+"""
+Shared helpers for the HKPF posting summary tools.
+
+Used by both streamlit_app.py and information_compiler.py so the two entry
+points read workbooks (and, over time, run the pipeline) the same way.
+"""
+import copy
+import functools
+import hashlib
+import io
+import json
+import math
+import os
+import re
+import threading
+import time
+import zipfile
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from docx import Document
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls, qn
+from docx.shared import Pt
+from docx.table import Table
+from openpyxl import load_workbook
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:  # optional: without pyarrow the on-disk frame cache is disabled
+    pa = pq = None
+
+# ========= WORKBOOK INGESTION =========
+HEADER_SCAN_ROWS = 60
+TARGET_HEADERS = {'date start', 'date end', 'post type'}
+
+
+def open_workbook(source):
+    """Open a workbook in openpyxl read-only mode (rows are streamed, not loaded up front)."""
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    return load_workbook(source, read_only=True, data_only=True, keep_links=False)
+
+
+def _convert_cell(cell):
+    # Same conversions pandas' openpyxl reader applies, so typed frames match pd.read_excel
+    if cell.value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return np.nan
+    if cell.data_type == TYPE_NUMERIC:
+        val = int(cell.value)
+        if val == cell.value:
+            return val
+        return float(cell.value)
+    return cell.value
+
+
+def iter_sheet_rows(wb, sheet_name=0):
+    """Lazily yield converted rows (trailing empty cells trimmed) from one sheet."""
+    ws = wb.worksheets[sheet_name] if isinstance(sheet_name, int) else wb[sheet_name]
+    ws.reset_dimensions()
+    for row in ws.iter_rows():
+        converted = [_convert_cell(cell) for cell in row]
+        while converted and converted[-1] == "":
+            converted.pop()
+        yield converted
+
+
+def probe_header(rows, max_rows: int = HEADER_SCAN_ROWS) -> tuple[int, dict, list]:
+    """
+    Consume rows lazily until the Date Start/Date End/Post Type header appears.
+    Returns (header_row, column_map, rows_read); column_map maps the lower-cased
+    header label to its column position. Only the header depth is read, so the
+    caller can keep iterating `rows` for the body.
+    """
+    rows_read = []
+    for i, row in enumerate(rows):
+        rows_read.append(row)
+        labels = [str(v).strip().lower() for v in row]
+        if TARGET_HEADERS.issubset(labels):
+            column_map = {}
+            for pos, label in enumerate(labels):
+                if label:
+                    column_map.setdefault(label, pos)
+            return i, column_map, rows_read
+        if i + 1 >= max_rows:
+            break
+    raise ValueError("Couldn't find header row with Date Start/Date End/Post Type. Check Excel manually.")
+
+
+def frame_from_rows(rows: list, header_row: int | None) -> pd.DataFrame:
+    """
+    Build the typed frame from already-read rows, using the row at `header_row`
+    as column labels. Equivalent to pd.read_excel(header=header_row) on the same
+    sheet; header_row=None gives the raw grid (header=None).
+    """
+    data = rows[header_row or 0:]
+    last = max((i for i, r in enumerate(data) if r), default=-1)
+    data = data[:last + 1]
+    if not data:
+        return pd.DataFrame()
+    width = max(len(r) for r in data)
+    data = [r + [""] * (width - len(r)) for r in data]
+    return TextParser(data, header=None if header_row is None else 0).read()
+
+
+PREVIEW_ROWS = 15
+
+
+def read_posting_sheet(wb, sheet_name=0) -> tuple[pd.DataFrame, int, list]:
+    """
+    One sheet of an open workbook in a single streamed pass: the header probe
+    stops at the header row and the body continues from the same row iterator.
+    Drops 'Unnamed' columns and fully blank rows. Returns (frame, header_row,
+    first PREVIEW_ROWS raw rows).
+    """
+    rows = iter_sheet_rows(wb, sheet_name)
+    header_row, _, head = probe_header(rows)
+    grid = head + list(rows)
+    preview = grid[:PREVIEW_ROWS]
+    df = frame_from_rows(grid, header_row)
+    del grid, head  # the cell grid is not needed once the frame exists
+    df = df.loc[:, ~df.columns.astype(str).str.startswith('Unnamed')]
+    df = df.dropna(how='all')
+    return df, header_row, preview
+
+
+PARALLEL_MIN_BYTES = 1024 * 1024
+
+
+def _workbook_size(source) -> int:
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    if hasattr(source, 'getbuffer'):
+        return source.getbuffer().nbytes
+    return len(source.getvalue()) if hasattr(source, 'getvalue') else 0
+
+
+def _read_sheet_job(source, sheet_name):
+    """Process-pool job: open the workbook in this worker and read one sheet."""
+    wb = open_workbook(io.BytesIO(source) if isinstance(source, bytes) else source)
+    try:
+        return read_posting_sheet(wb, sheet_name)
+    finally:
+        wb.close()
+
+
+def read_posting_sheets(source, all_sheets: bool = False, max_workers: int | None = None) -> tuple[list, list]:
+    """
+    read_posting_sheet for the first sheet, or with all_sheets every sheet,
+    of a workbook path or file-like. Returns (all sheet names, results in
+    sheet order).
+
+    Several sheets of a workbook of at least PARALLEL_MIN_BYTES are parsed on
+    a process pool (openpyxl parsing holds the GIL); each worker opens its
+    own read-only workbook, since one open workbook and its zip handle are
+    not safe to share. Smaller workbooks, or max_workers <= 1, are parsed
+    serially from one open workbook.
+    """
+    wb = open_workbook(source)
+    try:
+        sheet_names = list(wb.sheetnames)
+        names = sheet_names if all_sheets else sheet_names[:1]
+        if max_workers is None:
+            max_workers = min(len(names), os.cpu_count() or 1)
+        if max_workers <= 1 or len(names) <= 1 or _workbook_size(source) < PARALLEL_MIN_BYTES:
+            return sheet_names, [read_posting_sheet(wb, name) for name in names]
+    finally:
+        wb.close()
+    if isinstance(source, (str, os.PathLike)):
+        job_source = os.fspath(source)
+    else:
+        source.seek(0)
+        job_source = source.getvalue() if hasattr(source, 'getvalue') else source.read()
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(names))) as pool:
+        return sheet_names, list(pool.map(functools.partial(_read_sheet_job, job_source), names))
+
+
+def combine_sheet_frames(frames: list) -> pd.DataFrame:
+    """
+    Stack per-sheet frames into one with pd.concat, aligning columns by name.
+    No dtype conversion is done here: each column gets pandas' common dtype
+    for the sheets' dtypes (int + float -> float, text + numbers -> object),
+    and columns missing from a sheet are filled with NaN.
+    """
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_posting_workbook(source, combine_sheets: bool = False, max_workers: int | None = None) -> pd.DataFrame:
+    """
+    Load the first sheet, or, with combine_sheets, every sheet (parsed on a
+    process pool for large workbooks) stacked into one frame.
+    """
+    _, sheets = read_posting_sheets(source, combine_sheets, max_workers)
+    frames = [df for df, _, _ in sheets]
+    return combine_sheet_frames(frames) if combine_sheets else frames[0]
+
+
+# ========= RANK CLASSIFICATION =========
+_PUNCT_RE = re.compile(r'[().,;]')
+_WS_RE = re.compile(r'\s+')
+_IP_SIP_REWRITES = [
+    (re.compile(r'\bsenior\s+inspector(?:\s+of\s+police)?\b'), 'sip'),
+    (re.compile(r'\bsr\s+insp\b'), 'sip'),
+    (re.compile(r'\bsen\s+insp\b'), 'sip'),
+    (re.compile(r'\binspector(?:\s+of\s+police)?\b'), 'ip'),
+    (re.compile(r'\binsp\b'), 'ip'),
+]
+_TOKEN_SPLIT_RE = re.compile(r'[^a-z/]+')
+
+
+class RankClassifier:
+    """
+    Maps post type text to a rank code (IP and SIP both collapse to 'IP/SIP').
+
+    All rank_map aliases are compiled once into a single alternation, and
+    results are memoised per distinct input string, so a roster with a few
+    dozen distinct post types costs a few dozen classifications no matter
+    how many rows it has.
+    """
+
+    def __init__(self, rank_map: dict, acting_pattern, cache_size: int = 4096):
+        self.rank_map = dict(rank_map)
+        self.acting_pattern = acting_pattern
+        self._priority = {k: i for i, k in enumerate(self.rank_map)}
+        # Zero-width lookahead so overlapping aliases are all visited; at each
+        # position the alternation yields the earliest alias in rank_map order,
+        # which keeps "first alias in rank_map order wins" semantics.
+        self._alias_re = re.compile(
+            r'(?=\b(' + '|'.join(re.escape(k) for k in self.rank_map) + r')\b)'
+        )
+        self._cached = lru_cache(maxsize=cache_size)(self._classify)
+
+    def normalize(self, text: str) -> str:
+        s = str(text).strip().lower()
+        s = self.acting_pattern.sub('', s)
+        s = s.replace('\\', '/')
+        s = _PUNCT_RE.sub(' ', s)
+        return _WS_RE.sub(' ', s).strip()
+
+    @staticmethod
+    def looks_like_ip_sip(normalized: str) -> bool:
+        s2 = normalized
+        for pattern, repl in _IP_SIP_REWRITES:
+            s2 = pattern.sub(repl, s2)
+        tokens = set(_TOKEN_SPLIT_RE.split(s2))
+        tokens.discard('')
+        return ('ip' in tokens and 'sip' in tokens) or ('ip/sip' in s2)
+
+    def _classify(self, text: str):
+        s = self.normalize(text)
+        if self.looks_like_ip_sip(s):
+            return 'IP/SIP'
+        if not s:
+            return None
+        v = self.rank_map.get(s)
+        if v is None:
+            hits = {m.group(1) for m in self._alias_re.finditer(s)}
+            if hits:
+                v = self.rank_map[min(hits, key=self._priority.__getitem__)]
+        if v in {'IP', 'SIP'}:
+            return 'IP/SIP'
+        return v
+
+    def classify(self, text):
+        return self._cached(str(text or ""))
+
+    __call__ = classify
+
+    def map_series(self, series: pd.Series) -> pd.Series:
+        """Classify a whole column: each distinct value is classified once, then broadcast."""
+        codes, uniques = pd.factorize(series, use_na_sentinel=False)
+        mapped = np.array([self.classify(u) for u in uniques], dtype=object)
+        return pd.Series(mapped[codes], index=series.index, dtype=object)
+
+
+ACTING_COLUMNS = ('designation', 'designation_desc', 'post_type', 'post_type_desc')
+
+
+def acting_flags(df: pd.DataFrame, pattern, columns=ACTING_COLUMNS) -> pd.Series:
+    """
+    Row-wise acting/temporary flag: True where any of `columns` matches the
+    precompiled `pattern`. Each column is searched once per distinct value
+    (the per-value hits are broadcast back through factorize codes), and the
+    per-column masks are OR-ed. Same result as searching the ' || '-joined
+    cells, since no acting token spans the separator.
+    """
+    flags = np.zeros(len(df), dtype=bool)
+    for col in columns:
+        if col not in df.columns:
+            continue
+        codes, uniques = pd.factorize(df[col], use_na_sentinel=False)
+        hits = np.fromiter((pattern.search(str(u or '')) is not None for u in uniques),
+                           dtype=bool, count=len(uniques))
+        flags |= hits[codes]
+    return pd.Series(flags, index=df.index)
+
+
+# ========= DESIGNATION COALESCING =========
+_BLANK_TEXT = ["", "nan", "none", "null", "-"]
+
+
+def cell_text(series: pd.Series) -> pd.Series:
+    """
+    str(v or '') for every cell. Mapped per cell rather than per factorized
+    value: factorize treats True/1/1.0 and None/NaN as one value, which would
+    change the text some cells render as.
+    """
+    return series.astype(object).map(lambda v: str(v or ''))
+
+
+def final_designation(df: pd.DataFrame) -> pd.Series:
+    """
+    Designation (Description) when it holds text, else Designation, else ''.
+    Column-wise: strip once, then lower/isin masks pick the source via where.
+    """
+    empty = pd.Series('', index=df.index, dtype=object)
+    desc = cell_text(df['designation_desc']).str.strip() if 'designation_desc' in df.columns else empty
+    desig = cell_text(df['designation']).str.strip() if 'designation' in df.columns else empty
+    desig = desig.where(~desig.str.lower().isin(_BLANK_TEXT), '')
+    return desc.where(~desc.str.lower().isin(_BLANK_TEXT), desig)
+
+
+# ========= LOCATION CODE MATCHING =========
+class LocationIndex:
+    """
+    Whole-token location code matcher built once per alias vocabulary.
+
+    Codes are compiled longest-first into one alternation; a cell is scanned
+    once and the longest code found anywhere in it wins (ties keep vocabulary
+    order). Results are memoised per cell text.
+    """
+
+    def __init__(self, loc_alias: dict, cache_size: int = 8192):
+        self.loc_alias = dict(loc_alias)
+        self._by_upper = {}
+        for code in sorted(self.loc_alias, key=len, reverse=True):
+            self._by_upper.setdefault(code.upper(), (len(self._by_upper), code))
+        self._code_re = None
+        if self._by_upper:
+            self._code_re = re.compile(
+                r'(?=\b(' + '|'.join(re.escape(c) for c in self._by_upper) + r')\b)'
+            )
+        self._cached = lru_cache(maxsize=cache_size)(self._match)
+
+    def _match(self, text: str) -> str:
+        hit = self._by_upper.get(text)
+        if hit is None and self._code_re is not None:
+            found = {m.group(1) for m in self._code_re.finditer(text)}
+            if found:
+                hit = min((self._by_upper[c] for c in found), key=lambda h: h[0])
+        return self.loc_alias[hit[1]] if hit else ""
+
+    def match(self, value) -> str:
+        """Expanded location for the best code in one cell value, or ''."""
+        return self._cached(str(value).upper().strip())
+
+    def scan_row(self, values) -> str:
+        """First cell (in column order) containing a known code decides the location."""
+        for value in values:
+            if not value:
+                continue
+            found = self.match(value)
+            if found:
+                return found
+        return ""
+
+
+# ========= SUBSTANTIVE RANK RESOLUTION =========
+def _is_missing(v) -> bool:
+    return v is None or (isinstance(v, float) and math.isnan(v))
+
+
+def lower_rank_suffix_min(reported, acting, rank_index) -> np.ndarray:
+    """
+    suffix[i] is the lowest rank_index among non-acting rows with a reported
+    rank at positions >= i (inf when there are none); one reversed
+    minimum.accumulate over the per-row rank indices.
+    """
+    n = len(reported)
+    levels = np.fromiter(
+        (math.inf if acting[j] or _is_missing(reported[j]) else rank_index.get(reported[j], -1)
+         for j in range(n)),
+        dtype=float, count=n,
+    )
+    suffix = np.full(n + 1, math.inf)
+    if n:
+        suffix[:n] = np.minimum.accumulate(levels[::-1])[::-1]
+    return suffix
+
+
+def resolve_true_ranks(reported, acting, rank_index) -> list:
+    """
+    Substantive rank per row, in date order. A reported rank only becomes
+    substantive if no later non-acting row reports a lower rank; the
+    "any lower rank later?" check is an O(1) lookup into the suffix minimum.
+    Rows before the first substantive rank inherit it.
+
+    `reported` and `acting` are the two frame columns as arrays
+    (df['reported_rank'].to_numpy(), df['acting_flag'].to_numpy(dtype=bool));
+    the result is assigned back as the true_rank column.
+    """
+    suffix = lower_rank_suffix_min(reported, acting, rank_index)
+
+    def future_has_lower_than(from_idx, ref_rank):
+        return suffix[from_idx] < rank_index.get(ref_rank, -1)
+
+    true_ranks = []
+    current_substantive_rank = None
+    for i, rep in enumerate(reported):
+        if _is_missing(rep):
+            rep = None
+        is_acting = bool(acting[i])
+
+        if current_substantive_rank is None:
+            if rep is not None and not (is_acting or future_has_lower_than(i + 1, rep)):
+                current_substantive_rank = rep
+            true_ranks.append(current_substantive_rank)
+            continue
+
+        if rep is not None and not is_acting:
+            cur_idx = rank_index.get(current_substantive_rank, -1)
+            rep_idx = rank_index.get(rep, -1)
+            if rep_idx > cur_idx and not future_has_lower_than(i + 1, rep):
+                current_substantive_rank = rep
+        true_ranks.append(current_substantive_rank)
+
+    first_true = next((tr for tr in true_ranks if tr is not None), None)
+    if first_true is not None:
+        true_ranks = [first_true if tr is None else tr for tr in true_ranks]
+    return true_ranks
+
+
+# ========= YEAR RANGES BY CONTIGUOUS TRUE RANK =========
+def fmt_year_range(start_dt, end_dt):
+    if pd.isna(start_dt) and pd.isna(end_dt):
+        return "Unknown"
+    if pd.isna(start_dt):
+        return f"–{end_dt.year}"
+    sy = start_dt.year
+    if pd.isna(end_dt):
+        return f"{sy}–Present"
+    ey = end_dt.year
+    if ey < sy:
+        return f"{sy}"
+    return f"{sy}–{ey}"
+
+
+def build_rank_segments(df: pd.DataFrame) -> tuple[pd.Series, list]:
+    """
+    Run-length encode contiguous true_rank values into a segment_id per row
+    (true_rank != previous true_rank, cumulative sum) and take each segment's
+    date span with one grouped min/max.
+    Returns (segment_id series, year_ranges) where each year range carries
+    segment_id, true_rank, start, end and the formatted year_range.
+    """
+    true_rank = df['true_rank'] if 'true_rank' in df.columns else pd.Series(None, index=df.index, dtype=object)
+    if true_rank.isna().all():
+        return pd.Series(0, index=df.index), []
+
+    segment_id = true_rank.ne(true_rank.shift()).cumsum() - 1
+    no_dates = pd.Series(pd.NaT, index=df.index)
+    spans = pd.DataFrame({
+        'true_rank': true_rank,
+        'start': df['date_start'] if 'date_start' in df.columns else no_dates,
+        'end': df['date_end'] if 'date_end' in df.columns else no_dates,
+    }).groupby(segment_id.to_numpy(), sort=True).agg(
+        true_rank=('true_rank', 'first'), start=('start', 'min'), end=('end', 'max'),
+    )
+
+    year_ranges = [
+        {'segment_id': seg_id, 'true_rank': tr, 'start': start, 'end': end,
+         'year_range': fmt_year_range(start, end)}
+        for seg_id, tr, start, end in zip(spans.index.tolist(), spans['true_rank'], spans['start'], spans['end'])
+        if tr is not None
+    ]
+    return segment_id, year_ranges
+
+
+# ========= ROLE CANONICALIZATION CACHE =========
+def vocab_version(*tables) -> str:
+    """Short fingerprint of the vocabulary tables a canonicalizer depends on."""
+    payload = json.dumps(tables, sort_keys=True, ensure_ascii=False,
+                         default=lambda o: sorted(o) if isinstance(o, (set, frozenset)) else str(o))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+
+class RoleCache:
+    """
+    Process-wide, size-bounded LRU of role canonicalization results.
+
+    Keys are (namespace, vocabulary version, raw text), so the two entry
+    points' canonicalizers, and different vocabularies, never share entries.
+    Safe to use from Streamlit's script threads.
+    """
+
+    def __init__(self, maxsize: int = 20000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def wrap(self, fn, namespace: str, version: str):
+        """Memoise a one-argument role function; non-string inputs bypass the cache."""
+        @functools.wraps(fn)
+        def cached(raw):
+            if not isinstance(raw, str):
+                return fn(raw)
+            return self.get_or_compute((namespace, version, raw), lambda: fn(raw))
+        cached.uncached = fn
+        return cached
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+ROLE_CACHE = RoleCache()
+
+
+# ========= ROLE SYNONYM ENGINE =========
+_ANCHORED_LITERAL_RE = re.compile(r'^\^((?:[A-Za-z0-9 ,&/\'-]|\\[^A-Za-z0-9])+)\$$')
+_REGEX_ESCAPE_RE = re.compile(r'\\(.)')
+
+
+def _anchored_literal(pattern: str, repl: str):
+    """Lower-cased literal for an ASCII '^...$' pattern with a plain replacement, else None."""
+    m = _ANCHORED_LITERAL_RE.match(pattern)
+    if not m or '\\' in repl or not pattern.isascii():
+        return None
+    return _REGEX_ESCAPE_RE.sub(r'\1', m.group(1)).lower()
+
+
+class SynonymEngine:
+    """
+    Compiled, order-preserving form of a CANON_SYNONYMS table.
+
+    Equivalent to applying every rule in turn with
+    re.sub(pattern, repl, s, flags=re.IGNORECASE), but compiled once:
+      - runs of anchored literal rules ('^ADM$') become a dict lookup on the
+        lower-cased text;
+      - runs of other rules are gated in chunks by one combined search, so a
+        chunk with no match anywhere in the text costs a single regex pass.
+    Because a rule that does not match leaves the text untouched, skipping
+    a chunk (or jumping to the next matching literal) keeps the exact
+    sequential semantics of the original loop.
+    """
+
+    def __init__(self, table: dict, chunk_size: int = 8):
+        self.table = dict(table)
+        self._stages = []
+        run = []
+        for pattern, repl in self.table.items():
+            literal = _anchored_literal(pattern, repl)
+            kind = 'exact' if literal is not None else 'regex'
+            if run and run[0][0] != kind:
+                self._add_stage(run, chunk_size)
+                run = []
+            run.append((kind, literal, pattern, repl))
+        if run:
+            self._add_stage(run, chunk_size)
+
+    def _add_stage(self, run, chunk_size):
+        rules = [(re.compile(p, re.IGNORECASE), r) for _, _, p, r in run]
+        if run[0][0] == 'exact':
+            positions = {}
+            for i, (_, literal, _, _) in enumerate(run):
+                positions.setdefault(literal, []).append(i)
+            self._stages.append(('exact', positions, [r for _, _, _, r in run], rules))
+            return
+        for start in range(0, len(rules), chunk_size):
+            chunk = run[start:start + chunk_size]
+            gate = re.compile('|'.join(f'(?:{p})' for _, _, p, _ in chunk), re.IGNORECASE)
+            self._stages.append(('regex', gate, None, rules[start:start + chunk_size]))
+
+    def apply(self, s: str) -> str:
+        for kind, index, repls, rules in self._stages:
+            if kind == 'regex':
+                if index.search(s) is None:
+                    continue
+                for rx, repl in rules:
+                    s = rx.sub(repl, s)
+            elif s.isascii() and '\n' not in s:
+                # IGNORECASE equals lower() on ASCII; '$' would also match before
+                # a trailing newline, so such text takes the regex path.
+                pos = 0
+                while True:
+                    hits = index.get(s.lower())
+                    nxt = next((i for i in hits if i >= pos), None) if hits else None
+                    if nxt is None:
+                        break
+                    s = repls[nxt]
+                    pos = nxt + 1
+            else:
+                for rx, repl in rules:
+                    s = rx.sub(repl, s)
+        return s
+
+    __call__ = apply
+
+
+def apply_synonyms_naive(table: dict, s: str) -> str:
+    """Reference implementation: the original one-re.sub-per-rule loop."""
+    for pattern, repl in table.items():
+        s = re.sub(pattern, repl, s, flags=re.IGNORECASE)
+    return s
+
+
+def benchmark_synonyms(table: dict, roles, repeat: int = 5) -> dict:
+    """
+    Time the original rule loop against SynonymEngine over `roles`.
+
+    Reports microseconds per role for each (best of `repeat` runs) and
+    whether both produced identical output for every role.
+    """
+    roles = [str(r) for r in roles]
+    engine = SynonymEngine(table)
+
+    def best(fn):
+        timings = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            for r in roles:
+                fn(r)
+            timings.append(time.perf_counter() - t0)
+        return min(timings) * 1e6 / max(len(roles), 1)
+
+    naive_us = best(lambda r: apply_synonyms_naive(table, r))
+    engine_us = best(engine.apply)
+    return {
+        'roles': len(roles),
+        'rules': len(table),
+        'naive_us_per_role': round(naive_us, 2),
+        'engine_us_per_role': round(engine_us, 2),
+        'speedup': round(naive_us / engine_us, 1) if engine_us else None,
+        'identical': all(apply_synonyms_naive(table, r) == engine.apply(r) for r in roles),
+    }
+
+
+# ========= ROLE DEDUP (abbreviation / containment) =========
+class SubstringIndex:
+    """
+    Sorted suffix list over a set of strings.
+
+    Every string containing `needle` has a suffix starting with it, and those
+    suffixes sit in one contiguous run of the sorted list, so a lookup is a
+    bisect plus a walk over the actual hits rather than a scan of all strings.
+    """
+
+    def __init__(self, items):
+        entries = sorted((text[i:], owner) for text, owner in items for i in range(len(text)))
+        self._suffixes = [e[0] for e in entries]
+        self._owners = [e[1] for e in entries]
+
+    def owners(self, needle: str):
+        """Owners of every indexed string containing `needle` (once per occurrence)."""
+        for k in range(bisect_left(self._suffixes, needle), len(self._suffixes)):
+            if not self._suffixes[k].startswith(needle):
+                break
+            yield self._owners[k]
+
+
+def is_abbreviation_of(short, long):
+    """Check if short is an abbreviation of long (e.g., 'Ach Lia' for 'Architectural Liaison')."""
+    if len(short) >= len(long):
+        return False
+    short_words = short.upper().split()
+    long_words = long.upper().split()
+    if len(short_words) > len(long_words):
+        return False
+    # Check if short words match the first letters of long words or are substrings
+    for sw in short_words:
+        found = False
+        for lw in long_words:
+            if lw.startswith(sw) or sw in lw:
+                found = True
+                break
+        if not found:
+            return False
+    return True
+
+
+def contained_indices(keys) -> set:
+    """Indices whose key is a substring of a different key in `keys`."""
+    keys = list(keys)
+    distinct = list(dict.fromkeys(keys))
+    index = SubstringIndex((k, n) for n, k in enumerate(distinct))
+    covered = set()
+    for n, k in enumerate(distinct):
+        # Own full string is always one hit; any other owner is a strictly longer key.
+        if any(owner != n for owner in index.owners(k)):
+            covered.add(k)
+    return {i for i, k in enumerate(keys) if k in covered}
+
+
+def abbreviated_indices(roles) -> set:
+    """
+    Indices i with is_abbreviation_of(roles[i], roles[j]) for some j.
+
+    Candidates for each role are the roles having, for every one of its
+    words, some word containing it (looked up in a SubstringIndex of words);
+    only those are checked for the length and word-count conditions.
+    """
+    roles = list(roles)
+    words = [r.upper().split() for r in roles]
+    index = SubstringIndex((w, j) for j, ws in enumerate(words) for w in set(ws))
+    owners_of = {}
+    found = set()
+    for i, role in enumerate(roles):
+        candidates = None
+        for sw in set(words[i]):
+            if sw not in owners_of:
+                owners_of[sw] = set(index.owners(sw))
+            candidates = owners_of[sw] if candidates is None else candidates & owners_of[sw]
+            if not candidates:
+                break
+        if candidates is None:
+            candidates = range(len(roles))
+        n_words = len(words[i])
+        if any(len(role) < len(roles[j]) and n_words <= len(words[j]) for j in candidates):
+            found.add(i)
+    return found
+
+
+def drop_abbreviations(roles: list) -> list:
+    """Keep roles (in order) that are not an abbreviation of another role in the list."""
+    if len(roles) <= 1:
+        return list(roles)
+    dropped = abbreviated_indices(roles)
+    return [r for i, r in enumerate(roles) if i not in dropped]
+
+
+# ========= ROW ACCESS =========
+class RowView(Sequence):
+    """
+    Lazy, read-only rows of a DataFrame: view[i] is row i as a list, the same
+    values df.iloc[i].tolist() gives, built on demand from the column arrays
+    (no per-row copies are held).
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.columns = list(df.columns)
+        self._arrays = [df.iloc[:, j].array for j in range(df.shape[1])]
+        self._len = len(df)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _row(self, i: int) -> list:
+        return [v.item() if isinstance(v, np.generic) else v for v in (a[i] for a in self._arrays)]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._row(k) for k in range(*i.indices(self._len))]
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError("row index out of range")
+        return self._row(i)
+
+    def as_dict(self, i: int) -> dict:
+        return dict(zip(self.columns, self[i]))
+
+
+# ========= RESULT CACHE =========
+def content_digest(data: bytes) -> str:
+    """SHA-256 of an uploaded workbook's bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class ResultCache:
+    """
+    Process-wide LRU of finished summaries, keyed on (content digest, vocab version).
+
+    Each entry holds the enhanced ranges and the rendered .docx bytes. Eviction
+    keeps both the entry count and the approximate total size under their
+    bounds; the most recently used entry is always kept.
+    """
+
+    def __init__(self, max_entries: int = 32, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size_of(enhanced_ranges, docx_bytes) -> int:
+        return len(docx_bytes) + len(json.dumps(enhanced_ranges, default=str, ensure_ascii=False))
+
+    def get(self, key):
+        """(enhanced_ranges, docx_bytes) for key, or None."""
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key, enhanced_ranges, docx_bytes: bytes) -> None:
+        size = self._size_of(enhanced_ranges, docx_bytes)
+        with self._lock:
+            if key in self._data:
+                self._bytes -= self._sizes.pop(key)
+            self._data[key] = (enhanced_ranges, docx_bytes)
+            self._data.move_to_end(key)
+            self._sizes[key] = size
+            self._bytes += size
+            while len(self._data) > 1 and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                old, _ = self._data.popitem(last=False)
+                self._bytes -= self._sizes.pop(old)
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._data), 'bytes': self._bytes, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+
+# ========= ON-DISK FRAME CACHE =========
+FRAME_CACHE_FORMAT = 1  # bump when the stored layout or restore rules change
+_META_KEY = b'hkpf_frame'
+
+
+def default_cache_dir() -> Path:
+    """Per-user cache folder: %LOCALAPPDATA%\\hkpf on Windows, else $XDG_CACHE_HOME/hkpf or ~/.cache/hkpf."""
+    base = os.environ.get('LOCALAPPDATA') if os.name == 'nt' else os.environ.get('XDG_CACHE_HOME')
+    return Path(base or Path.home() / '.cache') / 'hkpf'
+
+
+def _arrow_restore_plan(df: pd.DataFrame):
+    """
+    How to restore each text column after a Parquet round trip, or None when
+    the frame cannot round-trip exactly (mixed-type or non-string object
+    columns, duplicate or non-string column names, exotic dtypes).
+
+    Object columns must hold only str plus one kind of missing value; Arrow
+    reads every missing value back as None, so 'nan' columns are re-filled.
+    String-dtype columns (pandas 3 loads text as 'str') are restored with
+    their original dtype.
+    """
+    if not df.columns.is_unique or not all(isinstance(c, str) for c in df.columns):
+        return None
+    plan = {}
+    for name in df.columns:
+        col = df[name]
+        if isinstance(col.dtype, pd.StringDtype):
+            plan[name] = str(col.dtype)
+            continue
+        if col.dtype != object:
+            if col.dtype.kind not in 'biufM' or getattr(col.dtype, 'tz', None) is not None:
+                return None
+            continue
+        values = col.to_numpy()
+        missing = pd.isna(values)
+        if not all(type(v) is str for v in values[~missing]):
+            return None
+        nulls = values[missing]
+        if len(nulls) == 0 or all(v is None for v in nulls):
+            plan[name] = 'none'
+        elif all(type(v) is float for v in nulls):
+            plan[name] = 'nan'
+        else:
+            return None
+    return plan
+
+
+class FrameCache:
+    """
+    On-disk cache of normalized workbook frames (header detected, columns
+    renamed, dates parsed), so a workbook is parsed by openpyxl once.
+
+    Two formats: 'parquet' (compressed, smallest on disk) and 'arrow', an
+    uncompressed Arrow IPC snapshot that is memory-mapped on read. Only
+    numeric and date columns without missing values come back as views of
+    the mapped file; columns holding NaN/NaT (date_end usually does) and
+    text columns are still copied out, so the saving is partial.
+
+    Entries are keyed on a SHA-256 of the workbook bytes (plus its mtime when
+    given a path), the pandas major version and a caller namespace that pins
+    the loader settings. Size is bounded by max_bytes with least-recently-used
+    eviction (a hit refreshes the entry's mtime). Location, size and format
+    default to HKPF_CACHE_DIR (default: the per-user default_cache_dir(), never
+    the working directory, since entries hold roster data; 'off' disables),
+    HKPF_CACHE_MAX_MB (default 512) and HKPF_CACHE_FORMAT (default 'parquet').
+    Every failure degrades to a cache miss; without pyarrow the cache is off.
+    """
+
+    suffixes = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+    def __init__(self, cache_dir=None, max_bytes: int | None = None, fmt: str | None = None):
+        if cache_dir is None:
+            cache_dir = os.environ.get('HKPF_CACHE_DIR') or default_cache_dir()
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get('HKPF_CACHE_MAX_MB', 512)) * 1024 * 1024)
+        fmt = (fmt or os.environ.get('HKPF_CACHE_FORMAT') or 'parquet').lower()
+        if fmt not in self.suffixes:
+            raise ValueError(f"Unknown frame cache format {fmt!r}; use 'parquet' or 'arrow'.")
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.fmt = fmt
+        self.suffix = self.suffixes[fmt]
+        self.enabled = pq is not None and str(cache_dir).strip().lower() not in {'', 'off', 'none', '0'}
+        self.hits = 0
+        self.misses = 0
+
+    def key_for(self, source, namespace: str, digest: str | None = None) -> str:
+        """
+        Cache key for a workbook path or file-like, scoped by namespace.
+
+        The workbook is hashed in chunks (the same SHA-256 as content_digest);
+        a caller that already has that digest passes it to skip the rehash.
+        """
+        stamp = ''
+        if isinstance(source, (str, os.PathLike)):
+            stamp = Path(source).stat().st_mtime_ns
+            if digest is None:
+                with open(source, 'rb') as f:
+                    digest = hashlib.file_digest(f, 'sha256').hexdigest()
+        elif digest is None:
+            source.seek(0)
+            digest = hashlib.file_digest(source, 'sha256').hexdigest()
+            source.seek(0)
+        major = pd.__version__.split('.')[0]
+        key = f'{FRAME_CACHE_FORMAT}|pandas{major}|{namespace}|{stamp}|{digest}'
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:40]
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f'{key}{self.suffix}'
+
+    def get(self, key: str):
+        """Cached frame for key, or None."""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            table = self._read_table(path)
+            plan = json.loads(table.schema.metadata[_META_KEY])
+            # split_blocks keeps each column its own block, so mapped buffers are not consolidated (copied)
+            df = table.to_pandas(split_blocks=True)
+            del table
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except Exception:
+            self._discard(path)
+            self.misses += 1
+            return None
+        for name, how in plan.items():
+            if how == 'nan':
+                df[name] = df[name].astype(object).where(df[name].notna(), np.nan)
+            elif how != 'none' and str(df[name].dtype) != how:
+                df[name] = df[name].astype(how)
+        self.hits += 1
+        return df
+
+    def put(self, key: str, df: pd.DataFrame) -> bool:
+        """Store df under key; returns False when disabled or the frame can't round-trip."""
+        if not self.enabled:
+            return False
+        plan = _arrow_restore_plan(df)
+        if plan is None:
+            return False
+        path = self._path(key)
+        tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            table = pa.Table.from_pandas(df, preserve_index=True)
+            meta = dict(table.schema.metadata or {})
+            meta[_META_KEY] = json.dumps(plan).encode('utf-8')
+            self._write_table(table.replace_schema_metadata(meta), tmp)
+            os.replace(tmp, path)
+        except Exception:
+            self._discard(tmp)
+            return False
+        self.evict()
+        return True
+
+    def _read_table(self, path: Path):
+        if self.fmt == 'arrow':
+            with pa.memory_map(str(path), 'r') as source:
+                return pa.ipc.open_file(source).read_all()
+        return pq.read_table(path)
+
+    def _write_table(self, table, path: Path) -> None:
+        if self.fmt == 'arrow':
+            with pa.OSFile(str(path), 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        else:
+            pq.write_table(table, path)
+
+    def evict(self) -> None:
+        """Drop least-recently-used entries (of either format) until the cache fits in max_bytes."""
+        entries = []
+        for suffix in self.suffixes.values():
+            for p in self.cache_dir.glob(f'*{suffix}'):
+                try:
+                    st = p.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, p))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, p in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            self._discard(p)
+            total -= size
+
+    @staticmethod
+    def _discard(path: Path) -> None:
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+    def stats(self) -> dict:
+        return {'dir': str(self.cache_dir), 'format': self.fmt, 'enabled': self.enabled,
+                'hits': self.hits, 'misses': self.misses}
+
+
+# ========= WORD RENDERING =========
+@lru_cache(maxsize=None)
+def _shading_prototype(fill: str):
+    return parse_xml(r'<w:shd {} w:fill="{}"/>'.format(nsdecls('w'), fill))
+
+
+def shading_element(fill: str):
+    """A fresh <w:shd> for one cell; the XML is parsed once per colour and deep-copied."""
+    return copy.deepcopy(_shading_prototype(fill))
+
+
+def shade_cell(cell, fill: str) -> None:
+    cell._element.get_or_add_tcPr().append(shading_element(fill))
+
+
+_RUN_BREAK_RE = re.compile(r'(\t|\r|\n)')
+_W_T, _W_TAB, _W_BR, _XML_SPACE = qn('w:t'), qn('w:tab'), qn('w:br'), qn('xml:space')
+
+
+def append_run_text(r, text: str) -> None:
+    """
+    Append `text` to a <w:r> the way python-docx's run.text does (tabs become
+    <w:tab/>, newlines <w:br/>, edge whitespace preserved), one element per
+    piece rather than one state-machine step per character.
+    """
+    for piece in _RUN_BREAK_RE.split(text):
+        if not piece:
+            continue
+        if piece == '\t':
+            r.append(r.makeelement(_W_TAB))
+        elif piece in '\r\n':
+            r.append(r.makeelement(_W_BR))
+        else:
+            t = r.makeelement(_W_T)
+            t.text = piece
+            if len(piece.strip()) < len(piece):
+                t.set(_XML_SPACE, 'preserve')
+            r.append(t)
+
+
+class TableRowWriter:
+    """
+    Appends text rows to a python-docx table by cloning one prebuilt <w:tr>.
+
+    The prototype row is taken from table.add_row() (so it carries the column
+    widths), shaded, and given one run per cell with the font size already in
+    its run properties. A data row is then one deepcopy plus the text elements
+    per cell, instead of cell lookups, XML parsing and run formatting per cell.
+    Produces the same XML as setting cell.text, shading and run.font.size.
+    """
+
+    _run_path = f"{qn('w:tc')}/{qn('w:p')}/{qn('w:r')}"
+
+    def __init__(self, table, fill: str = 'FFFFFF', size=Pt(13), prototype=None):
+        self._tbl = table._tbl
+        if prototype is None:
+            prototype = table.add_row()._tr
+            self._tbl.remove(prototype)
+            for tc in prototype.tc_lst:
+                tc.get_or_add_tcPr().append(shading_element(fill))
+                tc.clear_content()
+                tc.add_p().add_r().get_or_add_rPr().sz_val = size
+        self.prototype = prototype
+
+    def add_row(self, texts) -> None:
+        tr = copy.deepcopy(self.prototype)
+        for r, text in zip(tr.iterfind(self._run_path), texts):
+            append_run_text(r, text)
+        self._tbl.append(tr)
+
+
+class DocxTableTemplate:
+    """
+    A one-table .docx skeleton: styled table, column widths and a shaded,
+    bold header row, plus the prototype for data rows.
+
+    The skeleton is built with python-docx on first use, kept in memory as
+    .docx bytes, and cloned for every summary, so the default-template load,
+    style lookup and header formatting are paid once per process. Thread-safe;
+    keep one instance per process (module level, or st.cache_resource).
+
+    render() skips python-docx entirely: the untouched parts (styles, theme,
+    settings...) are kept as a ready-made zip, and only the filled-in
+    document.xml is compressed and appended per summary. The .docx is built
+    in one buffer and returned as bytes or written straight to a sink.
+    """
+
+    def __init__(self, header, widths, style: str = 'Light Grid Accent 1',
+                 header_fill: str = 'ADD8E6', row_fill: str = 'FFFFFF', size=Pt(13)):
+        self.header = tuple(header)
+        self.widths = tuple(widths)
+        self.style = style
+        self.header_fill = header_fill
+        self.row_fill = row_fill
+        self.size = size
+        self._lock = threading.Lock()
+        self._skeleton = None
+        self._row = None
+        self._document = None    # <w:document> element of the skeleton
+        self._body_part = None   # zip member name of the document part
+        self._parts_zip = None   # every other skeleton part, as a complete zip
+
+    def _build(self) -> None:
+        doc = Document()
+        table = doc.add_table(rows=1, cols=len(self.header))
+        table.style = self.style
+        for column, width in zip(table.columns, self.widths):
+            column.width = width
+        header_cells = table.rows[0].cells
+        for cell, label in zip(header_cells, self.header):
+            cell.text = label
+        for cell in header_cells:
+            shade_cell(cell, self.header_fill)
+            for paragraph in cell.paragraphs:
+                for run in paragraph.runs:
+                    run.bold = True
+                    run.font.size = self.size
+        self._row = TableRowWriter(table, self.row_fill, self.size).prototype
+        buf = io.BytesIO()
+        doc.save(buf)
+        self._skeleton = buf.getvalue()
+
+        self._document = doc.element
+        self._body_part = doc.part.partname.membername
+        parts = io.BytesIO()
+        with zipfile.ZipFile(io.BytesIO(self._skeleton)) as src, zipfile.ZipFile(parts, 'w') as dst:
+            for info in src.infolist():
+                if info.filename != self._body_part:
+                    dst.writestr(info, src.read(info))
+        self._parts_zip = parts.getvalue()
+
+    def _ensure_built(self) -> None:
+        with self._lock:
+            if self._skeleton is None:
+                self._build()
+
+    def render(self, rows, sink=None):
+        """
+        Fill the table with `rows` (one tuple of cell texts per row) and produce
+        the .docx: returned as bytes when sink is None, otherwise written to
+        `sink` (a path or a writable binary file) without an extra bytes copy.
+        """
+        self._ensure_built()
+        with self._lock:
+            document = copy.deepcopy(self._document)
+        writer = TableRowWriter(Table(document.body.find(qn('w:tbl')), None), prototype=self._row)
+        for texts in rows:
+            writer.add_row(texts)
+        body_xml = serialize_part_xml(document)
+        del document, writer
+
+        buf = io.BytesIO(self._parts_zip)
+        with zipfile.ZipFile(buf, 'a', compression=zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(self._body_part, body_xml)
+        del body_xml
+        if sink is None:
+            return buf.getvalue()
+        with buf.getbuffer() as view:
+            if isinstance(sink, (str, os.PathLike)):
+                with open(sink, 'wb') as f:
+                    f.write(view)
+            else:
+                sink.write(view)
+        return None
+
@@ -0,0 +1,349 @@
+import random
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import hkpf_core
+from hkpf_core import abbreviated_indices, contained_indices, drop_abbreviations, frame_from_rows, FrameCache, is_abbreviation_of, LocationIndex, RankClassifier, resolve_true_ranks, SynonymEngine
+
+
+# ========= SUBSTANTIVE RANK RESOLUTION =========
+RANK_ORDER = ['PC', 'SPC', 'SGT', 'SSGT', 'PI', 'IP', 'SIP', 'CIP', 'SP', 'SSP', 'CSP', 'ACP', 'SACP', 'DCP', 'CP']
+RANK_INDEX = {r: i for i, r in enumerate(RANK_ORDER)}
+RANK_INDEX['IP/SIP'] = RANK_INDEX['IP']
+
+
+def _old_resolve_true_ranks(reported, acting, rank_index):
+    """The original quadratic loop (future_has_lower_than rescans the rest of the career)."""
+    rows = [{'reported_rank': r, 'acting_flag': a} for r, a in zip(reported, acting)]
+
+    def future_has_lower_than(rows, from_idx, ref_rank):
+        if ref_rank is None:
+            return False
+        ref_idx = rank_index.get(ref_rank, -1)
+        for j in range(from_idx, len(rows)):
+            if bool(rows[j].get('acting_flag')):
+                continue
+            rj = rows[j].get('reported_rank')
+            if rj is None:
+                continue
+            if rank_index.get(rj, -1) < ref_idx:
+                return True
+        return False
+
+    current_substantive_rank = None
+    for i, r in enumerate(rows):
+        rep = r.get('reported_rank')
+        acting_ = bool(r.get('acting_flag'))
+        if current_substantive_rank is None:
+            if rep is None or acting_ or future_has_lower_than(rows, i + 1, rep):
+                r['true_rank'] = None
+            else:
+                current_substantive_rank = rep
+                r['true_rank'] = current_substantive_rank
+            continue
+        if rep is None or acting_:
+            r['true_rank'] = current_substantive_rank
+            continue
+        cur_idx = rank_index.get(current_substantive_rank, -1)
+        rep_idx = rank_index.get(rep, -1)
+        if rep_idx > cur_idx and not future_has_lower_than(rows, i + 1, rep):
+            current_substantive_rank = rep
+        r['true_rank'] = current_substantive_rank
+
+    first_true = next((r['true_rank'] for r in rows if r['true_rank'] is not None), None)
+    if first_true is not None:
+        for r in rows:
+            if r['true_rank'] is None:
+                r['true_rank'] = first_true
+    return [r['true_rank'] for r in rows]
+
+
+def test_resolve_true_ranks_matches_original_loop():
+    rng = random.Random(3)
+    choices = RANK_ORDER + ['IP/SIP', 'UNKNOWN', None, None]
+    for _ in range(500):
+        n = rng.randint(0, 40)
+        reported = [rng.choice(choices) for _ in range(n)]
+        acting = [rng.random() < 0.2 for _ in range(n)]
+        assert resolve_true_ranks(reported, acting, RANK_INDEX) == _old_resolve_true_ranks(reported, acting, RANK_INDEX)
+
+
+# ========= RANK CLASSIFICATION =========
+RANK_MAP = {
+    'pc': 'PC', 'police constable': 'PC',
+    'spc': 'SPC', 'senior police constable': 'SPC',
+    'sgt': 'SGT', 'sergeant': 'SGT',
+    'ssgt': 'SSGT', 'station sergeant': 'SSGT',
+    'pi': 'PI', 'probationary inspector': 'PI', 'probationary inspector of police': 'PI',
+    'ip': 'IP', 'insp': 'IP', 'inspector': 'IP', 'inspector of police': 'IP',
+    'sip': 'SIP', 'sr insp': 'SIP', 'sen insp': 'SIP', 'senior insp': 'SIP', 'senior inspector': 'SIP', 'senior inspector of police': 'SIP',
+    'cip': 'CIP', 'ch insp': 'CIP', 'chief insp': 'CIP', 'chief inspector': 'CIP', 'chief inspector of police': 'CIP',
+    'sp': 'SP', 'superintendent': 'SP', 'superintendent of police': 'SP',
+    'ssp': 'SSP', 'senior superintendent': 'SSP', 'senior superintendent of police': 'SSP',
+    'csp': 'CSP', 'chief superintendent': 'CSP', 'chief superintendent of police': 'CSP',
+    'acp': 'ACP', 'assistant commissioner': 'ACP', 'assistant commissioner of police': 'ACP',
+    'sacp': 'SACP', 'senior assistant commissioner': 'SACP', 'senior assistant commissioner of police': 'SACP',
+    'dcp': 'DCP', 'deputy commissioner': 'DCP', 'deputy commissioner of police': 'DCP',
+    'cp': 'CP', 'commissioner': 'CP', 'commissioner of police': 'CP',
+}
+ACTING_TOKENS = re.compile(r'\b(acting|actg|a/|ag\.|temp|temporary|acting up)\b', flags=re.IGNORECASE)
+
+
+def _old_map_rank(text, rank_map=RANK_MAP, acting_pattern=ACTING_TOKENS):
+    """The original map_rank: IP/SIP check, exact lookup, then one regex per alias."""
+    def looks_like_ip_sip(text):
+        s = str(text or "").lower()
+        s = acting_pattern.sub('', s)
+        s = s.replace('\\', '/')
+        s = re.sub(r'[().,;]', ' ', s)
+        s = re.sub(r'\s+', ' ', s).strip()
+        s2 = s
+        s2 = re.sub(r'\bsenior\s+inspector(?:\s+of\s+police)?\b', 'sip', s2)
+        s2 = re.sub(r'\bsr\s+insp\b', 'sip', s2)
+        s2 = re.sub(r'\bsen\s+insp\b', 'sip', s2)
+        s2 = re.sub(r'\binspector(?:\s+of\s+police)?\b', 'ip', s2)
+        s2 = re.sub(r'\binsp\b', 'ip', s2)
+        tokens = set(re.split(r'[^a-z/]+', s2))
+        tokens.discard('')
+        return ('ip' in tokens and 'sip' in tokens) or ('ip/sip' in s2)
+
+    if looks_like_ip_sip(text):
+        return 'IP/SIP'
+    s = str(text or "").strip().lower()
+    s = acting_pattern.sub('', s)
+    s = s.replace('\\', '/')
+    s = re.sub(r'[().,;]', ' ', s)
+    s = re.sub(r'\s+', ' ', s).strip()
+    if not s:
+        return None
+    if s in rank_map:
+        v = rank_map[s]
+    else:
+        v = None
+        for k, val in rank_map.items():
+            if re.search(r'\b' + re.escape(k) + r'\b', s):
+                v = val
+                break
+    if v in {'IP', 'SIP'}:
+        return 'IP/SIP'
+    return v
+
+
+def test_rank_classifier_matches_original_map_rank():
+    rng = random.Random(4)
+    words = list(RANK_MAP) + ['Acting', 'temp', 'of', 'police', 'IP/SIP', 'Sr. Insp.', '(A/)', 'A\\B',
+                              'Senior', 'Chief', 'team', '||', ',', 'nan', '']
+    classifier = RankClassifier(RANK_MAP, ACTING_TOKENS)
+    for _ in range(3000):
+        text = ' '.join(rng.choice(words) for _ in range(rng.randint(0, 5)))
+        if rng.random() < 0.5:
+            text = text.upper()
+        assert classifier.classify(text) == _old_map_rank(text), text
+
+
+# ========= LOCATION CODE MATCHING =========
+LOC_ALIAS = {
+    "CDIST": "CENTRAL DISTRICT", "CDIV": "CENTRAL DIVISION",
+    "TPDIST": "TUEN MUN DISTRICT", "TPDIST2": "TAI PO DISTRICT",
+    "WCH DIV": "WAN CHAI DIVISION", "WCH DIST": "WAN CHAI DISTRICT", "WCH": "WAN CHAI",
+    "STDIV": "SHA TIN DIVISION", "STDIV3": "STANLEY DIVISION",
+    "Hkg": "HONG KONG", "HKG": "HONG KONG ISLAND", "A&S": "ADMIN AND SUPPORT", "KE": "KOWLOON EAST",
+}
+
+
+def _old_extract_location(values, loc_alias=LOC_ALIAS):
+    """The original row scan: every cell tries each code, longest first, as a whole token."""
+    for col_value in values:
+        if not col_value:
+            continue
+        text = str(col_value).upper().strip()
+        for code in sorted(loc_alias.keys(), key=len, reverse=True):
+            code_upper = code.upper()
+            if code_upper == text or re.search(r'\b' + re.escape(code_upper) + r'\b', text):
+                return loc_alias[code]
+    return ""
+
+
+def test_location_index_matches_original_scan():
+    rng = random.Random(5)
+    pieces = list(LOC_ALIAS) + ['wch', 'div', 'DIST', 'TPDIST22', 'XCDIV', '-', '/', 'A&S', '&', 'POLICE', ' ']
+    index = LocationIndex(LOC_ALIAS)
+    for _ in range(3000):
+        row = [rng.choice(['', None, 0, 12]) if rng.random() < 0.2 else
+               rng.choice([' ', '', '-']).join(rng.choice(pieces) for _ in range(rng.randint(1, 4)))
+               for _ in range(rng.randint(0, 4))]
+        assert index.scan_row(row) == _old_extract_location(row), row
+
+
+# ========= ROLE SYNONYM ENGINE =========
+SYNONYMS = {
+    r'\bOPS\b': 'Operations',
+    r'\bOPS\s*\((\d+)\)': r'Operations (\1)',
+    r'^OPERATIONS\s*\((\d+)\)$': r'Operations (\1)',
+    r'^OPERATIONS$': 'Operations',
+    r'\bCMU\s*REL\b': 'Community Relations',
+    r'^CMU REL$': 'Community Relations',
+    r'^C M U REL$': 'Community Relations',
+    r'^COMMUNITY RELATIONS$': 'Community Relations',
+    r'^COMM REL$': 'Community Relations',
+    r'\bPSU\s*(\d+)\b': r'Patrol Sub-unit \1',
+    r'^PATROL\s+SUB-UNIT\s*(\d+)$': r'Patrol Sub-unit \1',
+    r'\bPLN\s*(\d+)\s*(?:CDR|COMMANDER)\b': r'Platoon \1 Commander',
+    r'\bPLN\s*(\d+)\b': r'Platoon \1',
+    r'^(?:CDR)$': '',
+    r'^ADMINISTRATION$': 'Administration',
+    r'^ADM$': 'Administration',
+    r'^ACH\s*LIA$': 'Architectural Liaison',
+    r'^PUB$': 'Publicity',
+    r'^PUBLICITY$': 'Publicity',
+    r'^SDVC$': 'Sub-divisional Commander',
+    r'\bCRM\s*\((\d+)\)\b': r'Crime (\1)',
+    r'\bCRM\b': 'Crime',
+    r'^CRIME$': 'Crime',
+}
+
+
+def _old_apply_synonyms(table, s):
+    """The original loop: one re.sub per rule, in table order."""
+    for pattern, repl in table.items():
+        s = re.sub(pattern, repl, s, flags=re.IGNORECASE)
+    return s
+
+
+def test_synonym_engine_matches_original_loop():
+    rng = random.Random(9)
+    words = ['OPS', 'ops (3)', 'Operations', 'operations(2)', 'CMU REL', 'cmu rel', 'C M U REL', 'Comm Rel',
+             'PSU 4', 'Patrol Sub-unit 7', 'PLN 2 CDR', 'pln 3', 'CDR', 'adm', 'ADMINISTRATION', 'Ach Lia',
+             'pub', 'Publicity', 'SDVC', 'CRM (1)', 'crm', 'Crime', 'Team', 'Kowloon', '\n', 'Pub\n', 'É']
+    engine = SynonymEngine(SYNONYMS)
+    for _ in range(3000):
+        text = rng.choice([' ', '', '  ']).join(rng.choice(words) for _ in range(rng.randint(1, 3)))
+        assert engine.apply(text) == _old_apply_synonyms(SYNONYMS, text), text
+
+
+# ========= ROLE DEDUP =========
+def _old_is_abbreviation_of(short, long):
+    if len(short) >= len(long):
+        return False
+    short_words = short.upper().split()
+    long_words = long.upper().split()
+    if len(short_words) > len(long_words):
+        return False
+    for sw in short_words:
+        if not any(lw.startswith(sw) or sw in lw for lw in long_words):
+            return False
+    return True
+
+
+def _old_contained(keys):
+    """The original all-pairs loop: key i is dropped when it sits inside a different key."""
+    return {i for i, k1 in enumerate(keys) for j, k2 in enumerate(keys) if i != j and k1 != k2 and k1 in k2}
+
+
+def _old_abbreviated(roles):
+    return {i for i, r1 in enumerate(roles) for j, r2 in enumerate(roles) if i != j and _old_is_abbreviation_of(r1, r2)}
+
+
+def _old_pick_best_designations(roles_out):
+    """The original greedy pairwise removal."""
+    if len(roles_out) <= 1:
+        return roles_out
+    to_remove = set()
+    for i, role1 in enumerate(roles_out):
+        if i in to_remove:
+            continue
+        for j, role2 in enumerate(roles_out):
+            if i == j or j in to_remove:
+                continue
+            if _old_is_abbreviation_of(role1, role2):
+                to_remove.add(i)
+            elif _old_is_abbreviation_of(role2, role1):
+                to_remove.add(j)
+    return [r for i, r in enumerate(roles_out) if i not in to_remove]
+
+
+def _random_roles(rng):
+    words = ['Ach', 'Lia', 'Architectural', 'Liaison', 'Pub', 'Publicity', 'Sa', 'Security', 'Advisory',
+             'Section', 'Team', 'Team 1', 'Ops', 'Operations', 'Crime', 'Cr', 'A', 'Admin']
+    return [' '.join(rng.choice(words) for _ in range(rng.randint(1, 3))) for _ in range(rng.randint(0, 12))]
+
+
+def test_role_dedup_matches_original_loops():
+    rng = random.Random(10)
+    for _ in range(1500):
+        roles = _random_roles(rng)
+        keys = [re.sub(r'[^a-z0-9]', '', r.casefold()) for r in roles]
+        assert contained_indices(keys) == _old_contained(keys), keys
+        assert abbreviated_indices(roles) == _old_abbreviated(roles), roles
+        assert drop_abbreviations(roles) == _old_pick_best_designations(roles), roles
+        for a, b in zip(roles, reversed(roles)):
+            assert is_abbreviation_of(a, b) == _old_is_abbreviation_of(a, b)
+
+
+# ========= ON-DISK FRAME CACHE =========
+requires_pyarrow = pytest.mark.skipif(hkpf_core.pa is None, reason="pyarrow not installed")
+
+
+def _roster_frame():
+    # Built the way the loaders build it, so text columns get whatever dtype
+    # the installed pandas infers (object on pandas 2, 'str' on pandas 3).
+    rows = [
+        ["Date Start", "Date End", "Post Type", "Designation", "Remarks"],
+        ["2001-01-02", "2003-04-05", "PC", "Constable", ""],
+        ["2003-04-06", "", "SGT", "Sergeant", "acting"],
+        ["2009-09-09", "", "IP", "", ""],
+    ]
+    df = frame_from_rows(rows, 0)
+    df.columns = ["date_start", "date_end", "post_type", "designation", "remarks"]
+    for col in ["date_start", "date_end"]:
+        df[col] = pd.to_datetime(df[col], errors="coerce")
+    df["row_no"] = np.arange(len(df))
+    df["score"] = [1.5, np.nan, 2.0]
+    return df
+
+
+@requires_pyarrow
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_frame_cache_round_trip(tmp_path, fmt):
+    df = _roster_frame()
+    cache = FrameCache(tmp_path, fmt=fmt)
+    assert cache.put("k", df)
+    back = cache.get("k")
+    pd.testing.assert_frame_equal(back, df)
+    assert cache.stats()["hits"] == 1
+
+
+@requires_pyarrow
+def test_frame_cache_round_trip_nan_object_column(tmp_path):
+    df = pd.DataFrame({"designation": pd.Series(["Constable", np.nan], dtype=object)})
+    cache = FrameCache(tmp_path)
+    assert cache.put("k", df)
+    back = cache.get("k")
+    assert back["designation"].dtype == object
+    assert back["designation"].iloc[0] == "Constable"
+    assert isinstance(back["designation"].iloc[1], float)
+
+
+@requires_pyarrow
+def test_frame_cache_rejects_mixed_object_column(tmp_path):
+    df = pd.DataFrame({"designation": pd.Series(["Constable", 3], dtype=object)})
+    assert not FrameCache(tmp_path).put("k", df)
+
+
+def test_frame_cache_defaults_to_user_cache_dir(monkeypatch, tmp_path):
+    monkeypatch.delenv("HKPF_CACHE_DIR", raising=False)
+    monkeypatch.setattr(hkpf_core, "default_cache_dir", lambda: tmp_path / "hkpf")
+    assert FrameCache().cache_dir == tmp_path / "hkpf"
+
+
+def test_frame_cache_key_from_digest_matches_streamed_hash(tmp_path):
+    path = tmp_path / "roster.xlsx"
+    path.write_bytes(bytes(range(256)) * 5000)
+    cache = FrameCache(tmp_path / "cache")
+    digest = hkpf_core.content_digest(path.read_bytes())
+    with open(path, "rb") as f:
+        assert cache.key_for(f, "ns") == cache.key_for(None, "ns", digest=digest)
+    assert cache.key_for(path, "ns") != cache.key_for(path, "other")
@@ -1,17 +1,18 @@
 
 import os
 import re
+import sys
 import json
 import glob
+import time
+import logging
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import pandas as pd
-from docx import Document
-from docx.shared import Pt, RGBColor, Inches
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.oxml import parse_xml
-from docx.oxml.ns import nsdecls
+from docx.shared import Pt, Inches
 from datetime import datetime
+from hkpf_core import read_posting_sheets, combine_sheet_frames, frame_from_rows, resolve_true_ranks, RankClassifier, acting_flags, build_rank_segments, ROLE_CACHE, vocab_version, SynonymEngine, benchmark_synonyms, contained_indices, abbreviated_indices, RowView, FrameCache, DocxTableTemplate
 
 # ========= CLI FLAGS + Interactive Filename Prompt (with last-used memory) =========
 parser = argparse.ArgumentParser(description="HKPF Posting Summary Processor")
@@ -21,16 +22,69 @@ parser.add_argument("--combine-sheets", action="store_true",
                     help="Combine all sheets (default uses first sheet only)")
 parser.add_argument("--file", default=None,
                     help="Path to Excel file (.xlsx). If omitted, you will be prompted.")
-args = parser.parse_args()
-
-EXPORT_UNKNOWNS = bool(args.export_unknowns)
-COMBINE_SHEETS = bool(args.combine_sheets)
+parser.add_argument("--batch", default=None, metavar="DIR_OR_GLOB",
+                    help="Summarise every .xlsx in a directory (or matching a glob) into one .docx each")
+parser.add_argument("--out-dir", default=None,
+                    help="Output folder for --batch (default: current directory)")
+parser.add_argument("--workers", type=int, default=1,
+                    help="Worker processes for --batch (default 1 = serial; 0 = one per CPU)")
+parser.add_argument("--cache-dir", default=None,
+                    help="Parsed-workbook cache folder (default: $HKPF_CACHE_DIR or the per-user cache folder, e.g. ~/.cache/hkpf; 'off' disables)")
+parser.add_argument("--cache-max-mb", type=float, default=None,
+                    help="Parsed-workbook cache size limit in MB (default: $HKPF_CACHE_MAX_MB or 512)")
+parser.add_argument("--cache-format", choices=["parquet", "arrow"], default=None,
+                    help="Cache entry format: compressed 'parquet', or 'arrow' snapshots that are memory-mapped "
+                         "on read (default: $HKPF_CACHE_FORMAT or parquet)")
+parser.add_argument("--no-cache", action="store_true",
+                    help="Always parse the workbook; do not read or write the cache")
+parser.add_argument("--row-view", action="store_true",
+                    help="Keep a lazy row_view over the processed rows for interactive (python -i) use")
+parser.add_argument("--bench-synonyms", action="store_true",
+                    help="Time CANON_SYNONYMS per role, original loop vs compiled engine")
+parser.add_argument("--log-level", choices=["quiet", "info", "debug"],
+                    default=os.environ.get("HKPF_LOG_LEVEL", "info"),
+                    help="quiet: JSON run summary and errors only; info: progress and the rank summary; "
+                         "debug: also raw sheet previews and the full per-row table (default: $HKPF_LOG_LEVEL or info)")
+
+# ========= LOGGING =========
+# Diagnostics go through one logger so the expensive DataFrame dumps only run at debug;
+# errors go to stderr, and every run (failed ones too) ends with one JSON summary line
+# on stdout, whatever the level.
+LOG_LEVELS = {"quiet": logging.WARNING, "info": logging.INFO, "debug": logging.DEBUG}
+log = logging.getLogger("hkpf.compiler")
+_silent_log = logging.getLogger("hkpf.compiler.silent")
+_silent_log.disabled = True
+
+def configure_logging(level: str = "info") -> None:
+    """Plain-message logging at the given level name (quiet/info/debug): progress on stdout, warnings and errors on stderr."""
+    out = logging.StreamHandler(sys.stdout)
+    out.addFilter(lambda record: record.levelno < logging.WARNING)
+    err = logging.StreamHandler(sys.stderr)
+    err.setLevel(logging.WARNING)
+    for handler in (out, err):
+        handler.setFormatter(logging.Formatter("%(message)s"))
+    log.handlers[:] = [out, err]
+    log.setLevel(LOG_LEVELS[level])
+    log.propagate = False
+
+def emit_run_summary(summary: dict) -> None:
+    """The machine-readable line for this run: one JSON object on stdout."""
+    print(json.dumps(summary, ensure_ascii=False, default=str), flush=True)
 
 HKPF_LAST_PATH = Path(".hkpf_last.json")
 
 def list_xlsx(cwd: Path) -> list[Path]:
     return sorted((Path(p) for p in glob.glob(str(cwd / "*.xlsx"))), key=lambda p: p.name.lower())
 
+def log_xlsx_listing(cwd: Path) -> None:
+    found = list_xlsx(cwd)
+    if found:
+        log.info("These .xlsx files are in this folder:")
+        for p in found:
+            log.info("  - %s", p.name)
+    else:
+        log.info("(No .xlsx files found in current folder.)")
+
 def resolve_input_filename(user_text: str, cwd: Path) -> Path | None:
     """
     Resolve a user-entered name to an .xlsx path in the current directory.
@@ -87,7 +141,8 @@ def prompt_for_file(cwd: Path) -> Path:
     """
     Prompt for a valid .xlsx filename.
     - Shows last-used file as default if available (press Enter to accept).
-    - On first failure, prints a list of .xlsx files in the folder.
+    - On first failure, logs a list of .xlsx files in the folder.
+    Raises FileNotFoundError after three failed attempts.
     """
     last_used = load_last_used()
     attempts = 3
@@ -110,16 +165,10 @@ def prompt_for_file(cwd: Path) -> Path:
             fallback = cwd / "PostingSummary.xlsx"
             if fallback.is_file():
                 return fallback.resolve()
-            print("[Error] Default 'PostingSummary.xlsx' not found in current folder.")
+            log.error("[Error] Default 'PostingSummary.xlsx' not found in current folder.")
             attempts -= 1
             if first_error:
-                found = list_xlsx(cwd)
-                if found:
-                    print("These .xlsx files are in this folder:")
-                    for p in found:
-                        print("  -", p.name)
-                else:
-                    print("(No .xlsx files found in current folder.)")
+                log_xlsx_listing(cwd)
                 first_error = False
             continue
 
@@ -127,33 +176,15 @@ def prompt_for_file(cwd: Path) -> Path:
         if resolved and resolved.is_file():
             return resolved
 
-        print(f"[Error] Could not find an .xlsx file for: {raw!r}. "
-              "Try again with a valid file that exists in this folder.")
+        log.error(f"[Error] Could not find an .xlsx file for: {raw!r}. "
+                  "Try again with a valid file that exists in this folder.")
         attempts -= 1
         if first_error:
-            found = list_xlsx(cwd)
-            if found:
-                print("These .xlsx files are in this folder:")
-                for p in found:
-                    print("  -", p.name)
-            else:
-                print("(No .xlsx files found in current folder.)")
+            log_xlsx_listing(cwd)
             first_error = False
 
-    raise SystemExit("Exiting: no valid Excel file was provided.")
-
-# Determine final file_path
-CWD = Path(os.getcwd())
-if args.file:
-    fp = resolve_input_filename(args.file, CWD)
-    if not fp:
-        raise SystemExit(f"[Error] --file '{args.file}' not found as an .xlsx in {CWD}.")
-    file_path = str(fp)
-else:
-    fp = prompt_for_file(CWD)
-    file_path = str(fp)
+    raise FileNotFoundError("Exiting: no valid Excel file was provided.")
 
-save_last_used(file_path)
 
 # ========= VOCAB FILES (learning loop) =========
 VOCAB_PATH = Path("hkpf_vocab.json")
@@ -355,45 +386,6 @@ def save_vocab(vocab):
     with open(VOCAB_PATH, "w", encoding="utf-8") as f:
         json.dump(vocab, f, ensure_ascii=False, indent=2)
 
-# ========= STARTUP =========
-print("Working directory:", os.getcwd())
-print("File exists?", os.path.exists(file_path))
-
-xls = pd.ExcelFile(file_path)
-print("Sheets found:", xls.sheet_names)
-
-# ========= STEP 1: READ + DETECT HEADER per sheet =========
-def detect_header_row(df_raw: pd.DataFrame) -> int:
-    target_headers = {'date start', 'date end', 'post type'}
-    header_row = None
-    for i in range(min(60, len(df_raw))):
-        row_vals = df_raw.iloc[i].astype(str).str.strip().str.lower().tolist()
-        if target_headers.issubset(set(row_vals)):
-            header_row = i
-            break
-    if header_row is None:
-        raise ValueError("Couldn't find header row with Date Start/Date End/Post Type. Check Excel manually.")
-    return header_row
-
-def load_sheet(sheet_name: str) -> pd.DataFrame:
-    raw = pd.read_excel(file_path, sheet_name=sheet_name, header=None)
-    print("\nRaw preview (first 15 rows):")
-    print(raw.head(15).to_string(index=True, header=False))
-    header_row = detect_header_row(raw)
-    print(f"\nDetected header row at index: {header_row}")
-    df_local = pd.read_excel(file_path, sheet_name=sheet_name, header=header_row)
-    df_local = df_local.loc[:, ~df_local.columns.astype(str).str.startswith('Unnamed')]
-    df_local = df_local.dropna(how='all')
-    print("\nDetected columns after cleanup (original):")
-    print(list(df_local.columns))
-    return df_local
-
-if COMBINE_SHEETS:
-    frames = [load_sheet(sh) for sh in xls.sheet_names]
-    df = pd.concat(frames, ignore_index=True)
-else:
-    df = load_sheet(xls.sheet_names[0])
-
 # ========= STEP 2: NORMALISE COLUMN NAMES =========
 def snake(s: str) -> str:
     return re.sub(r'\s+', '_', str(s).strip().lower())
@@ -413,17 +405,6 @@ aliases = {
     'major_formation': 'major_formation',
     'major_formation_(description)': 'major_formation_desc',
 }
-df = df.rename(columns={c: aliases.get(snake(c), snake(c)) for c in df.columns})
-
-# Parse dates
-for col in ['date_start', 'date_end']:
-    if col in df.columns:
-        df[col] = pd.to_datetime(df[col], errors='coerce')
-
-# Ensure presence of text columns
-for col in ['post_type', 'post_type_desc', 'designation', 'designation_desc', 'location', 'location_desc']:
-    if col not in df.columns:
-        df[col] = ""
 
 # ========= STEP 3: RANK MAPPING (IP/SIP preserved & enforced) =========
 rank_order = ['PC', 'SPC', 'SGT', 'SSGT', 'PI', 'IP', 'SIP', 'CIP', 'SP', 'SSP', 'CSP', 'ACP', 'SACP', 'DCP', 'CP']
@@ -450,43 +431,11 @@ rank_map = {
 
 acting_tokens_pattern = re.compile(r'\b(acting|actg|a/|ag\.|temp|temporary|acting up)\b', flags=re.IGNORECASE)
 
-def looks_like_ip_sip(text: str) -> bool:
-    s = str(text or "").lower()
-    s = acting_tokens_pattern.sub('', s)
-    s = s.replace('\\', '/')
-    s = re.sub(r'[().,;]', ' ', s)
-    s = re.sub(r'\s+', ' ', s).strip()
-    s2 = s
-    s2 = re.sub(r'\bsenior\s+inspector(?:\s+of\s+police)?\b', 'sip', s2)
-    s2 = re.sub(r'\bsr\s+insp\b', 'sip', s2)
-    s2 = re.sub(r'\bsen\s+insp\b', 'sip', s2)
-    s2 = re.sub(r'\binspector(?:\s+of\s+police)?\b', 'ip', s2)
-    s2 = re.sub(r'\binsp\b', 'ip', s2)
-    tokens = set(re.split(r'[^a-z/]+', s2))
-    tokens.discard('')
-    return ('ip' in tokens and 'sip' in tokens) or ('ip/sip' in s2)
+# Aliases compiled once; classifications memoised per distinct post type string
+rank_classifier = RankClassifier(rank_map, acting_tokens_pattern)
 
 def map_rank(text: str):
-    if looks_like_ip_sip(text):
-        return 'IP/SIP'
-    s = str(text or "").strip().lower()
-    s = acting_tokens_pattern.sub('', s)
-    s = s.replace('\\', '/')
-    s = re.sub(r'[().,;]', ' ', s)
-    s = re.sub(r'\s+', ' ', s).strip()
-    if not s:
-        return None
-    if s in rank_map:
-        v = rank_map[s]
-    else:
-        v = None
-        for k, val in rank_map.items():
-            if re.search(r'\b' + re.escape(k) + r'\b', s):
-                v = val
-                break
-    if v in {'IP', 'SIP'}:
-        return 'IP/SIP'
-    return v
+    return rank_classifier.classify(text)
 
 # ========= STEP 4: ACTING/TEMP DETECTION =========
 acting_kw_pattern = re.compile(r'(?i)\b(temp|temporary|acting|actg|acting up|a/|ag\.)\b|署任|代任|代理')
@@ -501,133 +450,6 @@ def is_acting(row) -> bool:
     haystack = ' || '.join(fields)
     return bool(acting_kw_pattern.search(haystack))
 
-# ========= STEP 5: SORT & PREP =========
-if 'date_start' in df.columns and df['date_start'].notna().any():
-    df = df.sort_values(by=['date_start', 'date_end'], ascending=[True, True], na_position='last').reset_index(drop=True)
-else:
-    df = df.reset_index(drop=True)
-
-df['reported_rank'] = (df['post_type'].astype(str) + ' || ' + df.get('post_type_desc', '').astype(str)).apply(map_rank)
-df['acting_flag'] = df.apply(is_acting, axis=1)
-
-# ========= STEP 6: TRUE (SUBSTANTIVE) RANK =========
-rows = df.to_dict(orient='records')
-
-def future_has_lower_than(rows, from_idx, ref_rank):
-    if ref_rank is None:
-        return False
-    ref_idx = rank_index.get(ref_rank, -1)
-    for j in range(from_idx, len(rows)):
-        if bool(rows[j].get('acting_flag')):
-            continue
-        rj = rows[j].get('reported_rank')
-        if rj is None:
-            continue
-        if rank_index.get(rj, -1) < ref_idx:
-            return True
-    return False
-
-current_substantive_rank = None
-for i, r in enumerate(rows):
-    rep = r.get('reported_rank')
-    acting = bool(r.get('acting_flag'))
-
-    if current_substantive_rank is None:
-        if rep is None:
-            r['true_rank'] = None
-        else:
-            looks_acting = acting or future_has_lower_than(rows, i + 1, rep)
-            if looks_acting:
-                r['true_rank'] = None
-            else:
-                current_substantive_rank = rep
-                r['true_rank'] = current_substantive_rank
-        continue
-
-    if rep is None:
-        r['true_rank'] = current_substantive_rank
-        continue
-
-    if acting:
-        r['true_rank'] = current_substantive_rank
-        continue
-
-    cur_idx = rank_index.get(current_substantive_rank, -1)
-    rep_idx = rank_index.get(rep, -1)
-
-    if rep_idx > cur_idx:
-        if future_has_lower_than(rows, i + 1, rep):
-            r['true_rank'] = current_substantive_rank
-        else:
-            current_substantive_rank = rep
-            r['true_rank'] = current_substantive_rank
-    else:
-        r['true_rank'] = current_substantive_rank
-
-first_true = next((rr.get('true_rank') for rr in rows if rr.get('true_rank') is not None), None)
-if first_true is not None:
-    for r in rows:
-        if r.get('true_rank') is None:
-            r['true_rank'] = first_true
-
-df = pd.DataFrame(rows)
-
-# ========= STEP 7: YEAR RANGES BY CONTIGUOUS TRUE RANK =========
-segments = []
-current_rank = None
-seg_start = None
-seg_end = None
-
-def max_dt(a, b):
-    if pd.isna(a): return b
-    if pd.isna(b): return a
-    return max(a, b)
-
-def min_dt(a, b):
-    if pd.isna(a): return b
-    if pd.isna(b): return a
-    return min(a, b)
-
-for _, row in df.iterrows():
-    tr = row.get('true_rank')
-    ds = row.get('date_start')
-    de = row.get('date_end')
-    if current_rank is None:
-        current_rank = tr
-        seg_start = ds
-        seg_end = de
-        continue
-    if tr != current_rank:
-        segments.append({'true_rank': current_rank, 'start': seg_start, 'end': seg_end})
-        current_rank = tr
-        seg_start = ds
-        seg_end = de
-    else:
-        seg_start = min_dt(seg_start, ds)
-        seg_end = max_dt(seg_end, de)
-
-if current_rank is not None:
-    segments.append({'true_rank': current_rank, 'start': seg_start, 'end': seg_end})
-
-def fmt_year_range(start_dt, end_dt):
-    if pd.isna(start_dt) and pd.isna(end_dt):
-        return "Unknown"
-    if pd.isna(start_dt):
-        return f"–{end_dt.year}"
-    sy = start_dt.year
-    if pd.isna(end_dt):
-        return f"{sy}–Present"
-    ey = end_dt.year
-    if ey < sy:
-        return f"{sy}"
-    return f"{sy}–{ey}"
-
-year_ranges = [
-    {'true_rank': seg['true_rank'], 'start': seg.get('start'), 'end': seg.get('end'),
-     'year_range': fmt_year_range(seg.get('start'), seg.get('end'))}
-    for seg in segments if seg.get('true_rank') is not None
-]
-
 # ========= STEP 8: LEARNING LOOP (vocab load + expansion utilities) =========
 vocab = load_vocab()
 role_exp = vocab.get("role_expansions", {})
@@ -754,8 +576,7 @@ def canonicalize_role(name: str) -> str:
     if not s:
         return ""
     # Run synonym expansions
-    for pattern, repl in CANON_SYNONYMS.items():
-        s = re.sub(pattern, repl, s, flags=re.IGNORECASE)
+    s = ROLE_SYNONYMS.apply(s)
     s = re.sub(r'\s+', ' ', s).strip()
     # Smart casing (keep acronyms), but do not uppercase everything
     s = smart_title_case_role(s)
@@ -944,6 +765,8 @@ CANON_SYNONYMS = {
     r'\bTeam\s*\d+[A-Z]?\b': 'Team',
 }
 
+ROLE_SYNONYMS = SynonymEngine(CANON_SYNONYMS)
+
 ROLE_ACRONYMS = {
     "HQCCC", "PTU", "EU", "RCCC", "CCB", "CAPO", "PCRO", "PPRB", 
     "DVIT", "PSU", "SDS", "DSDS", "RIU", "RATU", "ADC", "DDC", "DC", "RI", "ES", "OPS", "CS"
@@ -1018,8 +841,7 @@ def clean_and_canonicalize_role(raw_role: str) -> str:
         return ""
     
     # Apply canonicalization patterns (case-insensitive)
-    for pattern, repl in CANON_SYNONYMS.items():
-        s = re.sub(pattern, repl, s, flags=re.IGNORECASE)
+    s = ROLE_SYNONYMS.apply(s)
     
     # Normalize whitespace and punctuation
     s = normalize_whitespace_and_punctuation(s)
@@ -1045,6 +867,11 @@ def clean_and_canonicalize_role(raw_role: str) -> str:
     
     return s
 
+# Role canonicalization is pure given the tables above, so memoise it process-wide.
+ROLE_VOCAB_VERSION = vocab_version(vocab.get("version"), CANON_SYNONYMS, ROLE_ACRONYMS)
+canonicalize_role = ROLE_CACHE.wrap(canonicalize_role, "compiler.canonicalize_role", ROLE_VOCAB_VERSION)
+clean_and_canonicalize_role = ROLE_CACHE.wrap(clean_and_canonicalize_role, "compiler.clean_and_canonicalize_role", ROLE_VOCAB_VERSION)
+
 # ========= STEP 9: BUILD ENHANCED RANGES (locations + roles per location) =========
 def consolidate_row_roles(roles_out: list[str]) -> list[str]:
     """
@@ -1073,33 +900,14 @@ def consolidate_row_roles(roles_out: list[str]) -> list[str]:
     keep.discard("")
     return list(keep)
 
-enhanced_ranges = []
-for seg in year_ranges:
-    tr = seg['true_rank']
-    start_dt = seg['start']
-    end_dt = seg['end']
-
-    mask = (df['true_rank'] == tr)
-    if pd.notna(start_dt):
-        mask &= (df['date_start'].isna() | (df['date_start'] >= start_dt))
-    if pd.notna(end_dt):
-        mask &= (df['date_end'].isna() | (df['date_end'] <= end_dt))
-
-    sub = df.loc[mask].copy()
-
-    # Preferred location: Location (Description) -> fallback Location -> normalize/alias
-    loc_desc = sub['location_desc']
-    loc_series = loc_desc.where(
-        loc_desc.notna() & (loc_desc.astype(str).str.strip() != ''),
-        sub['location']
-    ).apply(normalize_location)
+def _text_or_empty(v) -> str:
+    return "" if _is_blankish(v) else str(v)
 
-    # Extract roles per row
 def extract_roles_from_row(r):
     roles_out = []
 
     # 1) If Designation Description exists → USE ONLY THAT
-    dd_raw = r.get('designation_desc') or ''
+    dd_raw = _text_or_empty(r.get('designation_desc'))
     if dd_raw.strip():
         dd = canonicalize_role(expand_role(dd_raw))
         if dd:
@@ -1107,7 +915,7 @@ def extract_roles_from_row(r):
         # Do NOT read designation at all when desc exists
     else:
         # 2) Otherwise fall back to Designation (try to expand if possible)
-        d_raw = r.get('designation') or ''
+        d_raw = _text_or_empty(r.get('designation'))
         if d_raw.strip() and not is_rank_text(d_raw):
             d = canonicalize_role(expand_role(d_raw))
             if d:
@@ -1115,7 +923,7 @@ def extract_roles_from_row(r):
 
     # 3) Post Type only if non-rank AND only if designation & desc gave nothing
     if not roles_out:
-        pt = r.get('post_type') or ''
+        pt = _text_or_empty(r.get('post_type'))
         if pt and not is_rank_text(pt):
             p = canonicalize_role(expand_role(pt))
             if p:
@@ -1131,186 +939,23 @@ def extract_roles_from_row(r):
             clean.append(x)
 
     return clean
-    
-
-    sub['role_list'] = sub.apply(extract_roles_from_row, axis=1)
-
-    # Group roles by location (case-insensitive dedup within each location)
-    roles_by_loc = {}
-    seen_by_loc = {}
-
-    for l, roles_here in zip(loc_series, sub['role_list']):
-        if not l:
-            continue
-        roles_by_loc.setdefault(l, [])
-        seen_by_loc.setdefault(l, set())
-        for role in roles_here:
-            if not role or role.upper() == "LEAVE RESERVE":
-                continue
-            # Canonicalize role one more time for location-level dedup
-            role_canonical = clean_and_canonicalize_role(role)
-            if not role_canonical:
-                continue
-            key = role_canonical.casefold()
-            if key not in seen_by_loc[l]:
-                roles_by_loc[l].append(role_canonical)
-                seen_by_loc[l].add(key)
-
-    # Deduplicate locations preserving order
-    unique_locs = []
-    seen_locs = set()
-    for l in loc_series.tolist():
-        if not l:
-            continue
-        if l not in seen_locs:
-            seen_locs.add(l)
-            unique_locs.append(l)
-    
-    # ===== DIVISION → DISTRICT MERGE =====
-    def extract_base_and_type(loc_name: str):
-        """Extract base and type from location name."""
-        s = str(loc_name or "").strip().upper()
-        s = re.sub(r'\s+', ' ', s)
-        
-        typ = None
-        if re.search(r'\bDIV(?:ISION)?\.?\b', s):
-            typ = 'DIVISION'
-        elif re.search(r'\bDIST(?:RICT)?\.?\b', s):
-            typ = 'DISTRICT'
-        
-        # Remove type tokens to get base
-        base = s
-        base = re.sub(r'\bDIV(?:ISION)?\.?\b', '', base)
-        base = re.sub(r'\bDIST(?:RICT)?\.?\b', '', base)
-        base = re.sub(r'\s+', ' ', base).strip()
-        
-        return base, typ
-    
-    # Map each base to its locations and types
-    base_to_locs = {}
-    for loc_name in unique_locs:
-        base, typ = extract_base_and_type(loc_name)
-        if base:
-            base_to_locs.setdefault(base, {'DIVISION': None, 'DISTRICT': None})
-            if typ:
-                base_to_locs[base][typ] = loc_name
-    
-    # Find Division→District merges and collect them
-    division_to_district_merge = {}
-    for base, locs_dict in base_to_locs.items():
-        if locs_dict['DIVISION'] and locs_dict['DISTRICT']:
-            # Both exist: merge Division into District
-            div_loc = locs_dict['DIVISION']
-            dist_loc = locs_dict['DISTRICT']
-            division_to_district_merge[div_loc] = dist_loc
-    
-    # Merge roles from Divisions into Districts
-    for div_loc, dist_loc in division_to_district_merge.items():
-        div_roles = roles_by_loc.pop(div_loc, [])
-        if dist_loc in roles_by_loc:
-            # Merge: add div roles to district, deduplicate
-            seen_in_dist = {r.casefold() for r in roles_by_loc[dist_loc]}
-            for r in div_roles:
-                if r.casefold() not in seen_in_dist:
-                    roles_by_loc[dist_loc].append(r)
-                    seen_in_dist.add(r.casefold())
-    
-    # Clean up all roles: standardize Room/Rm, remove numbered variants, deduplicate
-    for loc_name in roles_by_loc:
-        roles = roles_by_loc[loc_name]
-        # Canonicalize all roles again to ensure all variants are expanded
-        canonical_roles = [canonicalize_role(r) for r in roles]
-        # Deduplicate after canonicalization
-        unique_roles = []
-        seen = set()
-        for r in canonical_roles:
-            key = re.sub(r'[^a-z0-9]', '', r.casefold())
-            if key not in seen and r:
-                seen.add(key)
-                unique_roles.append(r)
-        # Fuzzy deduplication: remove any role that is a substring, abbreviation, or fuzzy match of a longer role in the same list
-        to_remove = set()
-        def norm(s):
-            return re.sub(r'[^a-z0-9]', '', s.casefold())
-        for i, role1 in enumerate(unique_roles):
-            for j, role2 in enumerate(unique_roles):
-                if i == j:
-                    continue
-                n1, n2 = norm(role1), norm(role2)
-                # Remove role1 if it is a substring or abbreviation of role2
-                if n1 != n2 and (n1 in n2 or is_abbreviation_of(role1, role2)):
-                    to_remove.add(i)
-        roles_by_loc[loc_name] = [r for i, r in enumerate(unique_roles) if i not in to_remove]
-    
-    # Rebuild unique locations list without Divisions
-    final_unique_locs = [loc for loc in unique_locs if loc not in division_to_district_merge]
-
-    enhanced_ranges.append({
-        'true_rank': tr,
-        'year_range': seg['year_range'],
-        'locations': final_unique_locs,
-        'roles_by_location': roles_by_loc
-    })
 
-# ========= STEP 10: data0, data1, ... convenience =========
-data_arrays = []
-for _, row in df.iterrows():
-    data_arrays.append(row.tolist())
-for i, arr in enumerate(data_arrays):
-    globals()[f"data{i}"] = arr
-
-# ========= STEP 11: OUTPUTS =========
-print("\n=== ALL rows with computed ranks ===")
-show_cols = [c for c in [
-    'date_start', 'date_end',
-    'post_type', 'post_type_desc',
-    'designation', 'designation_desc',
-    'reported_rank', 'acting_flag', 'true_rank',
-    'location', 'location_desc'
-] if c in df.columns]
-if show_cols:
-    print(df[show_cols].to_string(index=False))
-else:
-    print("(No displayable columns found)")
-
-print("\n=== True Rank Year Ranges (contiguous) + Locations & Roles ===")
-for item in enhanced_ranges:
-    print(f"{item['true_rank']}: {item['year_range']}")
-    if not item['locations']:
-        continue
-    for loc in item['locations']:
-        print(f"  {loc}")
-        roles = item['roles_by_location'].get(loc, [])
-        if roles:
-            for rname in roles:
-                print(f"    - {rname}")
-
-print("\nTotal rows of data:", len(data_arrays))
-if len(data_arrays) > 0:
-        # print("Example: data0 =", data0)
-    pass
-    pass
-
-# ========= STEP 12: Unknowns export + save vocab =========
-if EXPORT_UNKNOWNS:
-    unknown_payload = {
-        "role_tokens": sorted(t for t in unknown_role_tokens if t),
-        "location_labels": sorted(l for l in unknown_location_labels if l)
-    }
-    with open(UNKNOWN_PATH, "w", encoding="utf-8") as f:
-        json.dump(unknown_payload, f, ensure_ascii=False, indent=2)
-    print(f"\n[Info] Exported unknown tokens to {UNKNOWN_PATH.resolve()}")
-    pass
-
-save_vocab(vocab)
 # ========= STEP 13: GENERATE WORD DOCUMENT =========
+# Table style, widths and header are built once per process and cloned per document
+DOC_TEMPLATE = DocxTableTemplate(
+    header=("Year Range", "Rank", "Posting Location & Roles"),
+    widths=(Inches(1.0), Inches(1.2), Inches(4.3)),  # narrow Year Range and Rank, wide Posting Info
+    style='Light Grid Accent 1',
+    header_fill="ADD8E6",  # Light blue, bold 13pt
+    row_fill="FFFFFF",     # White, 13pt
+    size=Pt(13),
+)
+
 def generate_word_document(enhanced_ranges, output_filename="HKPF_Posting_Summary.docx"):
     """
     Generate a Word document with a table format.
     Table columns: Year Range | Rank | Posting Location & Roles
     """
-    doc = Document()
-    
     # Rank expansion mapping (without "of Police")
     rank_full_names = {
         'PC': 'Police Constable',
@@ -1331,35 +976,8 @@ def generate_word_document(enhanced_ranges, output_filename="HKPF_Posting_Summar
         'CP': 'Commissioner',
     }
     
-    # Helper function to shade cell
-    def shade_cell(cell, color):
-        shading_elm = parse_xml(r'<w:shd {} w:fill="{}"/>'.format(nsdecls('w'), color))
-        cell._element.get_or_add_tcPr().append(shading_elm)
-    
-    # Create table with 3 columns
-    table = doc.add_table(rows=1, cols=3)
-    table.style = 'Light Grid Accent 1'
-    
-    # Set column widths (narrow for Year Range and Rank, wide for Posting Info)
-    table.columns[0].width = Inches(1.0)  # Year Range - narrow
-    table.columns[1].width = Inches(1.2)  # Rank - narrow
-    table.columns[2].width = Inches(4.3)  # Posting Location & Roles - wide
-    
-    # Add header row
-    header_cells = table.rows[0].cells
-    header_cells[0].text = "Year Range"
-    header_cells[1].text = "Rank"
-    header_cells[2].text = "Posting Location & Roles"
-    
-    # Format header row - bold, size 13, light blue background
-    for cell in header_cells:
-        shade_cell(cell, "ADD8E6")  # Light blue
-        for paragraph in cell.paragraphs:
-            for run in paragraph.runs:
-                run.bold = True
-                run.font.size = Pt(13)
-    
-    # Add data rows
+    # Data rows - white background, size 13 (cloned from the skeleton's row prototype)
+    table_rows = []
     for item in enhanced_ranges:
         year_range = item['year_range']
         rank = item['true_rank']
@@ -1384,23 +1002,524 @@ def generate_word_document(enhanced_ranges, output_filename="HKPF_Posting_Summar
         posting_text = "\n".join(posting_info)
         
         # Add row
-        row_cells = table.add_row().cells
-        row_cells[0].text = year_range
-        row_cells[1].text = rank_display
-        row_cells[2].text = posting_text
-        
-        # Format data rows - white background, size 13
-        for cell in row_cells:
-            shade_cell(cell, "FFFFFF")  # White
-            for paragraph in cell.paragraphs:
-                for run in paragraph.runs:
-                    run.font.size = Pt(13)
+        table_rows.append((year_range, rank_display, posting_text))
     
-    # Save document
-    doc.save(output_filename)
+    # Save document: the pre-styled skeleton is filled and zipped straight to the file
+    DOC_TEMPLATE.render(table_rows, output_filename)
     return output_filename
 
-# Generate the Word document
-docx_file = generate_word_document(enhanced_ranges)
-print(f"\n[Success] Word document generated: {docx_file}")
-print(f"Location: {Path(docx_file).resolve()}")
\ No newline at end of file
+
+# ========= PIPELINE: one workbook -> enhanced ranges =========
+class PostingSummaryEngine:
+    """
+    Reusable workbook -> posting summary pipeline.
+
+    Build once and call per workbook, in-process: vocab, rank tables, synonym
+    engines and role caches are loaded at import and shared by every call.
+    The steps can be run one at a time:
+
+        engine = PostingSummaryEngine()
+        df = engine.load("roster.xlsx")                # steps 1-2
+        df = engine.resolve_ranks(df)                  # steps 5-6
+        df, enhanced_ranges = engine.build_ranges(df)  # steps 7, 9
+        engine.render(enhanced_ranges, "out.docx")     # step 13
+
+    or all at once with summarize() / summarize_to_docx().
+    verbose=True sends the CLI diagnostics to the "hkpf.compiler" logger
+    (per-row dumps at DEBUG, summaries at INFO); otherwise the engine is silent.
+    sheet_workers caps the worker processes parsing sheets with combine_sheets
+    (None: one per sheet up to the CPU count).
+    """
+
+    def __init__(self, combine_sheets: bool = False, verbose: bool = False,
+                 frame_cache: FrameCache | None = None, sheet_workers: int | None = None):
+        self.combine_sheets = combine_sheets
+        self.verbose = verbose
+        self.frame_cache = frame_cache
+        self.sheet_workers = sheet_workers
+
+    @property
+    def _log(self) -> logging.Logger:
+        return log if self.verbose else _silent_log
+
+    def load(self, file_path: str) -> pd.DataFrame:
+        """Read the roster sheet(s), detect the header, normalise column names and dates."""
+        log_ = self._log
+
+        # A workbook already parsed with the same settings is read back from the frame cache
+        cache_key = None
+        if self.frame_cache is not None and self.frame_cache.enabled:
+            cache_key = self.frame_cache.key_for(
+                file_path, f"compiler|combine={int(self.combine_sheets)}|{vocab_version(aliases)}")
+            cached = self.frame_cache.get(cache_key)
+            if cached is not None:
+                log_.info("[Cache] Reusing parsed workbook from %s", self.frame_cache.cache_dir)
+                return cached
+
+        # ========= STARTUP =========
+        log_.debug("Working directory: %s", os.getcwd())
+        log_.debug("File exists? %s", os.path.exists(file_path))
+
+        # ========= STEP 1: READ + DETECT HEADER per sheet =========
+        # One streamed pass per sheet (header probe, then body from the same row
+        # iterator); with --combine-sheets large workbooks are parsed on a process pool
+        sheet_names, sheets = read_posting_sheets(file_path, self.combine_sheets, self.sheet_workers)
+        log_.info("Sheets found: %s", sheet_names)
+
+        if log_.isEnabledFor(logging.DEBUG):
+            for df_local, header_row, preview in sheets:
+                log_.debug("\nRaw preview (first 15 rows):")
+                log_.debug(frame_from_rows(preview, None).to_string(index=True, header=False))
+                log_.debug("\nDetected header row at index: %s", header_row)
+                log_.debug("\nDetected columns after cleanup (original):")
+                log_.debug(list(df_local.columns))
+
+        frames = [df_local for df_local, _, _ in sheets]
+        del sheets
+        df = combine_sheet_frames(frames) if self.combine_sheets else frames[0]
+        del frames
+
+        # ========= STEP 2 (cont.): RENAME COLUMNS + PARSE DATES =========
+        df = df.rename(columns={c: aliases.get(snake(c), snake(c)) for c in df.columns})
+
+        # Parse dates
+        for col in ['date_start', 'date_end']:
+            if col in df.columns:
+                df[col] = pd.to_datetime(df[col], errors='coerce')
+
+        # Ensure presence of text columns
+        for col in ['post_type', 'post_type_desc', 'designation', 'designation_desc', 'location', 'location_desc']:
+            if col not in df.columns:
+                df[col] = ""
+
+        if cache_key is not None:
+            self.frame_cache.put(cache_key, df)
+        return df
+
+    def resolve_ranks(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Sort by date and add reported_rank, acting_flag and true_rank."""
+        # ========= STEP 5: SORT & PREP =========
+        if 'date_start' in df.columns and df['date_start'].notna().any():
+            df = df.sort_values(by=['date_start', 'date_end'], ascending=[True, True], na_position='last').reset_index(drop=True)
+        else:
+            df = df.reset_index(drop=True)
+
+        df['reported_rank'] = rank_classifier.map_series(df['post_type'].astype(str) + ' || ' + df.get('post_type_desc', '').astype(str))
+        df['acting_flag'] = acting_flags(df, acting_kw_pattern)
+
+        # ========= STEP 6: TRUE (SUBSTANTIVE) RANK =========
+        # Only the two input columns are handed to the resolver; the rest of the frame is untouched
+        df['true_rank'] = resolve_true_ranks(
+            df['reported_rank'].to_numpy(dtype=object),
+            df['acting_flag'].to_numpy(dtype=bool),
+            rank_index,
+        )
+
+        return df
+
+    def build_ranges(self, df: pd.DataFrame):
+        """Segment by contiguous true rank and collect locations/roles per segment."""
+        # ========= STEP 7: YEAR RANGES BY CONTIGUOUS TRUE RANK =========
+        df['segment_id'], year_ranges = build_rank_segments(df)
+
+        # ========= STEP 9 (cont.): LOCATIONS + ROLES PER SEGMENT =========
+        # Locations and roles are derived once over the whole frame, then grouped by segment.
+        # Preferred location: Location (Description) -> fallback Location -> normalize/alias
+        loc_desc = df['location_desc']
+        df['final_location'] = loc_desc.where(
+            loc_desc.notna() & (loc_desc.astype(str).str.strip() != ''),
+            df['location']
+        ).apply(normalize_location)
+        df['role_list'] = df.apply(extract_roles_from_row, axis=1)
+
+        segment_groups = dict(tuple(df.groupby('segment_id', sort=False)))
+        enhanced_ranges = []
+        for seg in year_ranges:
+            tr = seg['true_rank']
+            sub = segment_groups.get(seg['segment_id'], df.iloc[0:0])
+            loc_series = sub['final_location']
+
+            # Group roles by location (case-insensitive dedup within each location)
+            roles_by_loc = {}
+            seen_by_loc = {}
+
+            for l, roles_here in zip(loc_series, sub['role_list']):
+                if not l:
+                    continue
+                roles_by_loc.setdefault(l, [])
+                seen_by_loc.setdefault(l, set())
+                for role in roles_here:
+                    if not role or role.upper() == "LEAVE RESERVE":
+                        continue
+                    # Canonicalize role one more time for location-level dedup
+                    role_canonical = clean_and_canonicalize_role(role)
+                    if not role_canonical:
+                        continue
+                    key = role_canonical.casefold()
+                    if key not in seen_by_loc[l]:
+                        roles_by_loc[l].append(role_canonical)
+                        seen_by_loc[l].add(key)
+
+            # Deduplicate locations preserving order
+            unique_locs = []
+            seen_locs = set()
+            for l in loc_series.tolist():
+                if not l:
+                    continue
+                if l not in seen_locs:
+                    seen_locs.add(l)
+                    unique_locs.append(l)
+
+            # ===== DIVISION → DISTRICT MERGE =====
+            def extract_base_and_type(loc_name: str):
+                """Extract base and type from location name."""
+                s = str(loc_name or "").strip().upper()
+                s = re.sub(r'\s+', ' ', s)
+
+                typ = None
+                if re.search(r'\bDIV(?:ISION)?\.?\b', s):
+                    typ = 'DIVISION'
+                elif re.search(r'\bDIST(?:RICT)?\.?\b', s):
+                    typ = 'DISTRICT'
+
+                # Remove type tokens to get base
+                base = s
+                base = re.sub(r'\bDIV(?:ISION)?\.?\b', '', base)
+                base = re.sub(r'\bDIST(?:RICT)?\.?\b', '', base)
+                base = re.sub(r'\s+', ' ', base).strip()
+
+                return base, typ
+
+            # Map each base to its locations and types
+            base_to_locs = {}
+            for loc_name in unique_locs:
+                base, typ = extract_base_and_type(loc_name)
+                if base:
+                    base_to_locs.setdefault(base, {'DIVISION': None, 'DISTRICT': None})
+                    if typ:
+                        base_to_locs[base][typ] = loc_name
+
+            # Find Division→District merges and collect them
+            division_to_district_merge = {}
+            for base, locs_dict in base_to_locs.items():
+                if locs_dict['DIVISION'] and locs_dict['DISTRICT']:
+                    # Both exist: merge Division into District
+                    div_loc = locs_dict['DIVISION']
+                    dist_loc = locs_dict['DISTRICT']
+                    division_to_district_merge[div_loc] = dist_loc
+
+            # Merge roles from Divisions into Districts
+            for div_loc, dist_loc in division_to_district_merge.items():
+                div_roles = roles_by_loc.pop(div_loc, [])
+                if dist_loc in roles_by_loc:
+                    # Merge: add div roles to district, deduplicate
+                    seen_in_dist = {r.casefold() for r in roles_by_loc[dist_loc]}
+                    for r in div_roles:
+                        if r.casefold() not in seen_in_dist:
+                            roles_by_loc[dist_loc].append(r)
+                            seen_in_dist.add(r.casefold())
+
+            # Clean up all roles: standardize Room/Rm, remove numbered variants, deduplicate
+            for loc_name in roles_by_loc:
+                roles = roles_by_loc[loc_name]
+                # Canonicalize all roles again to ensure all variants are expanded
+                canonical_roles = [canonicalize_role(r) for r in roles]
+                # Deduplicate after canonicalization
+                unique_roles = []
+                seen = set()
+                for r in canonical_roles:
+                    key = re.sub(r'[^a-z0-9]', '', r.casefold())
+                    if key not in seen and r:
+                        seen.add(key)
+                        unique_roles.append(r)
+                # Fuzzy deduplication: remove any role that is a substring or abbreviation of another role in the same list
+                to_remove = contained_indices(re.sub(r'[^a-z0-9]', '', r.casefold()) for r in unique_roles)
+                to_remove |= abbreviated_indices(unique_roles)
+                roles_by_loc[loc_name] = [r for i, r in enumerate(unique_roles) if i not in to_remove]
+
+            # Rebuild unique locations list without Divisions
+            final_unique_locs = [loc for loc in unique_locs if loc not in division_to_district_merge]
+
+            enhanced_ranges.append({
+                'true_rank': tr,
+                'year_range': seg['year_range'],
+                'locations': final_unique_locs,
+                'roles_by_location': roles_by_loc
+            })
+
+        return df, enhanced_ranges
+
+    def report(self, df: pd.DataFrame, enhanced_ranges: list) -> None:
+        """Log the per-row rank table (debug) and the range summary (info); verbose only."""
+        log_ = self._log
+
+        # ========= STEP 11: OUTPUTS =========
+        # Formatting every row is the slow part of a run, so it only happens at debug
+        if log_.isEnabledFor(logging.DEBUG):
+            log_.debug("\n=== ALL rows with computed ranks ===")
+            show_cols = [c for c in [
+                'date_start', 'date_end',
+                'post_type', 'post_type_desc',
+                'designation', 'designation_desc',
+                'reported_rank', 'acting_flag', 'true_rank',
+                'location', 'location_desc'
+            ] if c in df.columns]
+            if show_cols:
+                log_.debug(df[show_cols].to_string(index=False))
+            else:
+                log_.debug("(No displayable columns found)")
+
+        if log_.isEnabledFor(logging.INFO):
+            log_.info("\n=== True Rank Year Ranges (contiguous) + Locations & Roles ===")
+            for item in enhanced_ranges:
+                log_.info(f"{item['true_rank']}: {item['year_range']}")
+                if not item['locations']:
+                    continue
+                for loc in item['locations']:
+                    log_.info(f"  {loc}")
+                    roles = item['roles_by_location'].get(loc, [])
+                    if roles:
+                        for rname in roles:
+                            log_.info(f"    - {rname}")
+
+        log_.info("\nTotal rows of data: %s", len(df))
+        log_.debug("Role cache: %s", ROLE_CACHE.stats())
+
+    def render(self, enhanced_ranges: list, output_filename: str = "HKPF_Posting_Summary.docx") -> str:
+        return generate_word_document(enhanced_ranges, output_filename=output_filename)
+
+    def summarize(self, file_path: str):
+        """load -> resolve_ranks -> build_ranges; returns (df, enhanced_ranges)."""
+        df = self.resolve_ranks(self.load(file_path))
+        return self.build_ranges(df)
+
+    def summarize_to_docx(self, src: str, target: str) -> dict:
+        """
+        One batch item: workbook -> .docx, never raising. Returns its status record,
+        including the unknown tokens it added so a parallel parent can merge them.
+        """
+        t0 = datetime.now()
+        seen_roles, seen_locs = set(unknown_role_tokens), set(unknown_location_labels)
+        entry = {"file": src, "output": None, "status": "ok", "error": None,
+                 "rows": 0, "ranges": 0}
+        try:
+            df, enhanced_ranges = self.summarize(src)
+            entry["output"] = str(self.render(enhanced_ranges, output_filename=target))
+            entry["rows"] = len(df)
+            entry["ranges"] = len(enhanced_ranges)
+        except Exception as e:
+            entry["status"] = "error"
+            entry["error"] = f"{type(e).__name__}: {e}"
+        entry["seconds"] = round((datetime.now() - t0).total_seconds(), 3)
+        entry["unknown_role_tokens"] = sorted(unknown_role_tokens - seen_roles)
+        entry["unknown_location_labels"] = sorted(unknown_location_labels - seen_locs)
+        return entry
+
+# ========= STEP 12: Unknowns export + save vocab =========
+def save_learning_state(export_unknowns: bool = False):
+    """Export unknown tokens (if requested) and persist the vocab; once per run."""
+    if export_unknowns:
+        unknown_payload = {
+            "role_tokens": sorted(t for t in unknown_role_tokens if t),
+            "location_labels": sorted(l for l in unknown_location_labels if l)
+        }
+        with open(UNKNOWN_PATH, "w", encoding="utf-8") as f:
+            json.dump(unknown_payload, f, ensure_ascii=False, indent=2)
+        log.info("\n[Info] Exported unknown tokens to %s", UNKNOWN_PATH.resolve())
+        pass
+
+    save_vocab(vocab)
+
+
+# ========= BATCH MODE =========
+def expand_batch_inputs(spec: str, cwd: Path) -> list[Path]:
+    """
+    Workbooks for --batch: a directory (all *.xlsx in it, via list_xlsx) or a
+    glob pattern such as 'rosters/**/*.xlsx'. Excel lock files (~$*.xlsx) are skipped.
+    """
+    p = Path(spec).expanduser()
+    if not p.is_absolute():
+        p = cwd / p
+    if p.is_dir():
+        found = list_xlsx(p)
+    else:
+        found = sorted((Path(m) for m in glob.glob(str(p), recursive=True)
+                        if m.lower().endswith(".xlsx")), key=lambda q: str(q).lower())
+    return [q.resolve() for q in found if q.is_file() and not q.name.startswith("~$")]
+
+def batch_output_name(src: Path, out_dir: Path, taken: set) -> Path:
+    """'<stem>_Posting_Summary.docx' in out_dir, numbered if two inputs share a stem."""
+    target = out_dir / f"{src.stem}_Posting_Summary.docx"
+    n = 2
+    while target in taken:
+        target = out_dir / f"{src.stem}_Posting_Summary_{n}.docx"
+        n += 1
+    taken.add(target)
+    return target
+
+_BATCH_ENGINE = None
+
+def _init_batch_worker(shared_vocab: dict, combine_sheets: bool, cache_settings) -> None:
+    """Pool initializer: adopt the parent's vocab (read-only) and build one engine per worker."""
+    global vocab, role_exp, loc_alias, _BATCH_ENGINE
+    vocab = shared_vocab
+    role_exp = vocab.get("role_expansions", {})
+    loc_alias = vocab.get("location_aliases", {})
+    frame_cache = FrameCache(*cache_settings) if cache_settings else None
+    # The pool already uses every core, so each worker parses its sheets serially
+    _BATCH_ENGINE = PostingSummaryEngine(combine_sheets=combine_sheets, frame_cache=frame_cache, sheet_workers=1)
+
+def _batch_item(src: str, target: str) -> dict:
+    return _BATCH_ENGINE.summarize_to_docx(src, target)
+
+def run_batch(inputs: list[Path], out_dir: Path, engine: PostingSummaryEngine, workers: int = 1) -> list[dict]:
+    """
+    Summarise every workbook into its own .docx; one failure does not stop the run.
+    workers > 1 fans the files out over a process pool. Returns one status record
+    per input (in input order), also written to out_dir/hkpf_batch_report.json.
+    """
+    out_dir = out_dir.resolve()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    taken = set()
+    jobs = [(str(src), str(batch_output_name(src, out_dir, taken))) for src in inputs]
+    report = [None] * len(jobs)
+    done = 0
+
+    def record(i: int, entry: dict) -> None:
+        nonlocal done
+        done += 1
+        unknown_role_tokens.update(entry.pop("unknown_role_tokens", []))
+        unknown_location_labels.update(entry.pop("unknown_location_labels", []))
+        report[i] = entry
+        name = Path(jobs[i][0]).name
+        detail = f"{entry['ranges']} ranges -> {Path(jobs[i][1]).name}" if entry["status"] == "ok" else entry["error"]
+        log.info(f"[{done}/{len(jobs)}] {entry['status'].upper():5} {name}: {detail}")
+
+    if workers <= 1:
+        for i, (src, target) in enumerate(jobs):
+            record(i, engine.summarize_to_docx(src, target))
+    else:
+        fc = engine.frame_cache
+        cache_settings = (str(fc.cache_dir), fc.max_bytes, fc.fmt) if fc is not None and fc.enabled else None
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                 initargs=(vocab, engine.combine_sheets, cache_settings)) as pool:
+            futures = {pool.submit(_batch_item, src, target): i
+                       for i, (src, target) in enumerate(jobs)}
+            for fut in as_completed(futures):
+                i = futures[fut]
+                try:
+                    entry = fut.result()
+                except Exception as e:  # the worker itself died (e.g. BrokenProcessPool)
+                    entry = {"file": jobs[i][0], "output": None, "status": "error",
+                             "error": f"{type(e).__name__}: {e}", "rows": 0, "ranges": 0,
+                             "seconds": None}
+                record(i, entry)
+
+    report_path = out_dir / "hkpf_batch_report.json"
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    failed = sum(1 for e in report if e["status"] != "ok")
+    log.info(f"\n[Batch] {len(report) - failed} ok, {failed} failed. Report: {report_path.resolve()}")
+    return report
+
+# ========= MAIN =========
+# Set by --row-view: row_view[i] is processed row i (python -i information_compiler.py --row-view)
+row_view = None
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    configure_logging(args.log_level)
+    t0 = time.perf_counter()
+    CWD = Path(os.getcwd())
+    frame_cache = None
+    if not args.no_cache:
+        max_bytes = int(args.cache_max_mb * 1024 * 1024) if args.cache_max_mb is not None else None
+        # One default format for single-file and --batch runs, so a workbook has one cache entry
+        frame_cache = FrameCache(args.cache_dir, max_bytes, args.cache_format)
+    engine = PostingSummaryEngine(combine_sheets=args.combine_sheets, verbose=not args.batch,
+                                  frame_cache=frame_cache)
+
+    if args.batch:
+        batch_inputs = expand_batch_inputs(args.batch, CWD)
+        if not batch_inputs:
+            error = f"--batch '{args.batch}' matched no .xlsx files."
+            log.error("[Error] %s", error)
+            emit_run_summary({"event": "batch", "inputs": 0, "ok": 0, "failed": 0, "error": error,
+                              "seconds": round(time.perf_counter() - t0, 3)})
+            raise SystemExit(1)
+        workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+        out_dir = Path(args.out_dir) if args.out_dir else CWD
+        batch_report = run_batch(batch_inputs, out_dir, engine, workers=workers)
+        if workers == 1:
+            log.debug("Role cache: %s", ROLE_CACHE.stats())
+        save_learning_state(args.export_unknowns)
+        failed = sum(1 for e in batch_report if e["status"] != "ok")
+        emit_run_summary({
+            "event": "batch", "inputs": len(batch_report), "ok": len(batch_report) - failed,
+            "failed": failed, "workers": workers,
+            "rows": sum(e["rows"] for e in batch_report),
+            "report": str((out_dir / "hkpf_batch_report.json").resolve()),
+            "seconds": round(time.perf_counter() - t0, 3),
+        })
+        if failed:
+            raise SystemExit(1)
+        return
+
+    file_path = None
+    try:
+        if args.file:
+            fp = resolve_input_filename(args.file, CWD)
+            if not fp:
+                raise FileNotFoundError(f"--file '{args.file}' not found as an .xlsx in {CWD}.")
+        else:
+            fp = prompt_for_file(CWD)
+        file_path = str(fp)
+
+        save_last_used(file_path)
+
+        df, enhanced_ranges = engine.summarize(file_path)
+
+        if args.bench_synonyms:
+            bench_roles = sorted({r for roles in df['role_list'] for r in roles if isinstance(r, str)})
+            log.info("\n[Bench] CANON_SYNONYMS per role: %s", benchmark_synonyms(CANON_SYNONYMS, bench_roles))
+
+        # ========= STEP 10: row access (opt-in, replaces the old data0, data1, ... globals) =========
+        if args.row_view:
+            global row_view
+            row_view = RowView(df)
+
+        # ========= STEP 11: OUTPUTS =========
+        engine.report(df, enhanced_ranges)
+
+        save_learning_state(args.export_unknowns)
+
+        # Generate the Word document
+        docx_file = engine.render(enhanced_ranges)
+    except Exception as e:
+        # A failed run still ends with its JSON line (and exit status 1); the traceback is debug-only
+        error = f"{type(e).__name__}: {e}"
+        log.error("[Error] %s", error)
+        log.debug("Traceback:", exc_info=True)
+        emit_run_summary({
+            "event": "summary", "ok": False, "file": file_path, "error": error,
+            "sheets": "all" if args.combine_sheets else "first",
+            "seconds": round(time.perf_counter() - t0, 3),
+        })
+        raise SystemExit(1)
+
+    log.info("\n[Success] Word document generated: %s", docx_file)
+    log.info("Location: %s", Path(docx_file).resolve())
+
+    emit_run_summary({
+        "event": "summary", "ok": True, "file": file_path, "output": str(Path(docx_file).resolve()),
+        "sheets": "all" if args.combine_sheets else "first",
+        "rows": len(df), "ranges": len(enhanced_ranges),
+        "frame_cache": frame_cache.stats() if frame_cache is not None else None,
+        "role_cache": ROLE_CACHE.stats(),
+        "seconds": round(time.perf_counter() - t0, 3),
+    })
+
+
+# Guarded so importing this module (an engine user, a process-pool worker) never runs the CLI
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import pandas as pd
 import re
 import json
 from pathlib import Path
+from hkpf_core import load_posting_workbook, resolve_true_ranks, RankClassifier, acting_flags, final_designation, LocationIndex, build_rank_segments, ROLE_CACHE, vocab_version, SynonymEngine, contained_indices, drop_abbreviations, ResultCache, content_digest, FrameCache, DocxTableTemplate
 
 st.set_page_config(page_title="HKPF Posting Summary Generator", layout="wide")
 st.title("📊 HKPF Posting Summary Generator")
@@ -38,15 +39,6 @@ def canonicalize_role(name):
     s = re.sub(r'\s+', ' ', s).strip()
     return s
 
-def get_final_designation(row):
-    desc = str(row.get('designation_desc', '') or '').strip()
-    if desc and desc.lower() not in {"", "nan", "none", "null", "-"}:
-        return desc
-    desig = str(row.get('designation', '') or '').strip()
-    if desig and desig.lower() not in {"", "nan", "none", "null", "-"}:
-        return desig
-    return ''
-
 def deduplicate_roles(role_list):
     # Canonicalize and keep only the longest unique form for each normalized key
     norm_map = {}
@@ -58,17 +50,9 @@ def deduplicate_roles(role_list):
         if key not in norm_map or len(canon) > len(norm_map[key]):
             norm_map[key] = canon
     # Remove abbreviations if a full form exists
-    final_roles = set(norm_map.values())
-    to_remove = set()
-    for r1 in final_roles:
-        for r2 in final_roles:
-            if r1 == r2:
-                continue
-            r1_norm = re.sub(r'\s+', '', r1).lower()
-            r2_norm = re.sub(r'\s+', '', r2).lower()
-            if r1_norm != r2_norm and r1_norm in r2_norm:
-                to_remove.add(r1)
-    deduped = [r for r in sorted(final_roles - to_remove)]
+    final_roles = sorted(set(norm_map.values()))
+    to_remove = contained_indices(re.sub(r'\s+', '', r).lower() for r in final_roles)
+    deduped = [r for i, r in enumerate(final_roles) if i not in to_remove]
     # Final aggressive dedup: remove any role that matches (case-insensitive, ignoring spaces) any other role already in the list
     truly_unique = []
     seen_norms = set()
@@ -86,7 +70,7 @@ def process_excel(file):
     for col in ['designation', 'designation_desc', 'location', 'location_desc']:
         if col not in df.columns:
             df[col] = ''
-    df['final_designation'] = df.apply(get_final_designation, axis=1)
+    df['final_designation'] = final_designation(df)
     df['designation'] = df['final_designation']
     df['designation_desc'] = df['final_designation']
     # Use location_desc if present, else location
@@ -122,13 +106,9 @@ import pandas as pd
 import re
 import json
 from pathlib import Path
-from docx import Document
 from docx.shared import Inches, Pt, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.oxml import parse_xml
-from docx.oxml.ns import nsdecls
 from datetime import datetime
-import io
 
 st.set_page_config(page_title="HKPF Posting Summary Generator", layout="wide")
 
@@ -297,6 +277,9 @@ STARTER_LOCATION_ALIASES = {
     "RIU NTN": "REGIONAL INTELLIGENCE UNIT NEW TERRITORIES NORTH",
 }
 
+# Location codes compiled once (longest-first) for row scanning
+STARTER_LOCATION_INDEX = LocationIndex(STARTER_LOCATION_ALIASES)
+
 # ========= CORE PROCESSING FUNCTIONS =========
 rank_order = ['PC', 'SPC', 'SGT', 'SSGT', 'PI', 'IP', 'SIP', 'CIP', 'SP', 'SSP', 'CSP', 'ACP', 'SACP', 'DCP', 'CP']
 rank_index = {r: i for i, r in enumerate(rank_order)}
@@ -318,43 +301,11 @@ rank_map = {
 
 acting_tokens_pattern = re.compile(r'\b(acting|actg|a/|ag\.|temp|temporary|acting up)\b', flags=re.IGNORECASE)
 
-def looks_like_ip_sip(text: str) -> bool:
-    s = str(text or "").lower()
-    s = acting_tokens_pattern.sub('', s)
-    s = s.replace('\\', '/')
-    s = re.sub(r'[().,;]', ' ', s)
-    s = re.sub(r'\s+', ' ', s).strip()
-    s2 = s
-    s2 = re.sub(r'\bsenior\s+inspector(?:\s+of\s+police)?\b', 'sip', s2)
-    s2 = re.sub(r'\bsr\s+insp\b', 'sip', s2)
-    s2 = re.sub(r'\bsen\s+insp\b', 'sip', s2)
-    s2 = re.sub(r'\binspector(?:\s+of\s+police)?\b', 'ip', s2)
-    s2 = re.sub(r'\binsp\b', 'ip', s2)
-    tokens = set(re.split(r'[^a-z/]+', s2))
-    tokens.discard('')
-    return ('ip' in tokens and 'sip' in tokens) or ('ip/sip' in s2)
+# Aliases compiled once; classifications memoised per distinct post type string
+rank_classifier = RankClassifier(rank_map, acting_tokens_pattern)
 
 def map_rank(text: str):
-    if looks_like_ip_sip(text):
-        return 'IP/SIP'
-    s = str(text or "").strip().lower()
-    s = acting_tokens_pattern.sub('', s)
-    s = s.replace('\\', '/')
-    s = re.sub(r'[().,;]', ' ', s)
-    s = re.sub(r'\s+', ' ', s).strip()
-    if not s:
-        return None
-    if s in rank_map:
-        v = rank_map[s]
-    else:
-        v = None
-        for k, val in rank_map.items():
-            if re.search(r'\b' + re.escape(k) + r'\b', s):
-                v = val
-                break
-    if v in {'IP', 'SIP'}:
-        return 'IP/SIP'
-    return v
+    return rank_classifier.classify(text)
 
 def is_acting(row) -> bool:
     fields = [
@@ -366,18 +317,6 @@ def is_acting(row) -> bool:
     haystack = ' || '.join(fields)
     return bool(acting_tokens_pattern.search(haystack))
 
-def detect_header_row(df_raw: pd.DataFrame) -> int:
-    target_headers = {'date start', 'date end', 'post type'}
-    header_row = None
-    for i in range(min(60, len(df_raw))):
-        row_vals = df_raw.iloc[i].astype(str).str.strip().str.lower().tolist()
-        if target_headers.issubset(set(row_vals)):
-            header_row = i
-            break
-    if header_row is None:
-        raise ValueError("Couldn't find header row with Date Start/Date End/Post Type.")
-    return header_row
-
 def snake(s: str) -> str:
     return re.sub(r'\s+', '_', str(s).strip().lower())
 
@@ -571,6 +510,8 @@ CANON_SYNONYMS = {
     r'(\w+\s+)*(\w+)\s+\d+$': r'\2',  # Catch-all: remove trailing numbers from any role
 }
 
+ROLE_SYNONYMS = SynonymEngine(CANON_SYNONYMS)
+
 ROLE_ACRONYMS = {
     "HQCCC", "PTU", "EU", "RCCC", "CCB", "CAPO", "PCRO", "PPRB", 
     "DVIT", "PSU", "SDS", "DSDS", "RIU", "RATU", "ADC", "DDC", "DC", "RI", "ES", "OPS", "CS"
@@ -607,63 +548,12 @@ def normalize_whitespace_and_punctuation(text: str) -> str:
     s = re.sub(r'\s+', ' ', s).strip()
     return s
 
-def is_abbreviation_of(abbrev: str, full: str) -> bool:
-    """
-    Check if abbrev is likely an abbreviation of full.
-    Returns True if abbrev could be the short form of full.
-    
-    Examples:
-      - "Ach Lia" is abbreviation of "Architectural Liaison"
-      - "Pub" is abbreviation of "Publicity"
-      - "Sa" is abbreviation of "Security Advisory Section"
-    """
-    abbrev = abbrev.strip().lower()
-    full = full.strip().lower()
-    
-    if not abbrev or not full or len(abbrev) >= len(full):
-        return False
-    
-    # Split into words
-    abbrev_words = abbrev.split()
-    full_words = full.split()
-    
-    # If abbrev has fewer words, check if each abbrev word starts with or is in each full word
-    if len(abbrev_words) == len(full_words):
-        # Check if each word in abbrev is the first letter(s) of the corresponding full word or appears in it
-        for aw, fw in zip(abbrev_words, full_words):
-            if not (fw.startswith(aw) or aw in fw):
-                return False
-        return True
-    
-    return False
-
-
 def pick_best_designations(roles_out: list) -> list:
     """
     Remove abbreviations when their full form is present.
     Keeps only the longer/fuller version of designation pairs.
     """
-    if len(roles_out) <= 1:
-        return roles_out
-    
-    # Mark roles to remove
-    to_remove = set()
-    
-    for i, role1 in enumerate(roles_out):
-        if i in to_remove:
-            continue
-        for j, role2 in enumerate(roles_out):
-            if i == j or j in to_remove:
-                continue
-            # Check if one is an abbreviation of the other
-            if is_abbreviation_of(role1, role2):
-                # role1 is abbreviation of role2, so remove role1
-                to_remove.add(i)
-            elif is_abbreviation_of(role2, role1):
-                # role2 is abbreviation of role1, so remove role2
-                to_remove.add(j)
-    
-    return [r for i, r in enumerate(roles_out) if i not in to_remove]
+    return drop_abbreviations(roles_out)
 
 def clean_and_canonicalize_role(raw_role: str) -> str:
     """Clean, expand, canonicalize, and format a single role."""
@@ -683,8 +573,7 @@ def clean_and_canonicalize_role(raw_role: str) -> str:
         return ""
     
     # Apply canonicalization patterns (case-insensitive)
-    for pattern, repl in CANON_SYNONYMS.items():
-        s = re.sub(pattern, repl, s, flags=re.IGNORECASE)
+    s = ROLE_SYNONYMS.apply(s)
     
     # Normalize whitespace and punctuation
     s = normalize_whitespace_and_punctuation(s)
@@ -710,26 +599,16 @@ def clean_and_canonicalize_role(raw_role: str) -> str:
     
     return s
 
-def extract_location_codes_from_row(r, loc_alias):
+# Role canonicalization is pure given the tables above, so memoise it process-wide.
+ROLE_VOCAB_VERSION = vocab_version(CANON_SYNONYMS, ROLE_ACRONYMS)
+clean_and_canonicalize_role = ROLE_CACHE.wrap(clean_and_canonicalize_role, "streamlit.clean_and_canonicalize_role", ROLE_VOCAB_VERSION)
+
+def extract_location_codes_from_row(r, loc_index):
     """
     Search ALL columns in a row for known location codes.
-    Returns the first location code found and its expanded form.
+    Returns the expanded form of the first location code found.
     """
-    # Scan all values in the row
-    for col_value in r.values:
-        if not col_value:
-            continue
-        text = str(col_value).upper().strip()
-        
-        # Look for location codes - prioritize longer codes first to avoid partial matches
-        for code in sorted(loc_alias.keys(), key=len, reverse=True):
-            code_upper = code.upper()
-            # Check if code appears as a whole token (with word boundaries)
-            if code_upper == text or re.search(r'\b' + re.escape(code_upper) + r'\b', text):
-                # Found a location code
-                return loc_alias[code]
-    
-    return ""
+    return loc_index.scan_row(r.values)
 
 def cleanup_role_variants(role):
     """
@@ -751,25 +630,6 @@ def cleanup_role_variants(role):
     
     return cleaned
 
-def is_abbreviation_of(short, long):
-    """Check if short is an abbreviation of long (e.g., 'Ach Lia' for 'Architectural Liaison')."""
-    if len(short) >= len(long):
-        return False
-    short_words = short.upper().split()
-    long_words = long.upper().split()
-    if len(short_words) > len(long_words):
-        return False
-    # Check if short words match the first letters of long words or are substrings
-    for sw in short_words:
-        found = False
-        for lw in long_words:
-            if lw.startswith(sw) or sw in lw:
-                found = True
-                break
-        if not found:
-            return False
-    return True
-
 def extract_roles_from_row(r):
     """Extract and canonicalize roles from a row, preferring full forms over abbreviations."""
     
@@ -797,20 +657,12 @@ def extract_roles_from_row(r):
 
     return roles_out
 
-def process_excel_file(uploaded_file):
-    """Process the uploaded Excel file and return enhanced ranges."""
+# Parsed-workbook cache in the per-user cache folder (location/size via HKPF_CACHE_DIR / HKPF_CACHE_MAX_MB)
+FRAME_CACHE = FrameCache()
+
+def process_excel_file(uploaded_file, combine_sheets=False, digest=None):
+    """Process the uploaded Excel file and return enhanced ranges (all sheets stacked with combine_sheets; digest: its content_digest, if already known)."""
     try:
-        # Read Excel file
-        xls = pd.ExcelFile(uploaded_file)
-        df = pd.read_excel(uploaded_file, sheet_name=xls.sheet_names[0], header=None)
-        
-        # Detect header
-        header_row = detect_header_row(df)
-        df = pd.read_excel(uploaded_file, sheet_name=xls.sheet_names[0], header=header_row)
-        df = df.loc[:, ~df.columns.astype(str).str.startswith('Unnamed')]
-        df = df.dropna(how='all')
-        
-        # Normalize columns
         aliases = {
             'date_start': 'date_start', 'date_start_(description)': 'date_start_desc',
             'date_end': 'date_end', 'date_end_(description)': 'date_end_desc',
@@ -818,188 +670,85 @@ def process_excel_file(uploaded_file):
             'designation': 'designation', 'designation_(description)': 'designation_desc',
             'location': 'location', 'location_(description)': 'location_desc',
         }
-        df = df.rename(columns={c: aliases.get(snake(c), snake(c)) for c in df.columns})
         
-        # Parse dates
-        for col in ['date_start', 'date_end']:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
+        # A workbook parsed before (same bytes) is read back from the on-disk frame cache
+        cache_key = None
+        df = None
+        if FRAME_CACHE.enabled:
+            cache_key = FRAME_CACHE.key_for(uploaded_file, f"streamlit|combine={int(combine_sheets)}|{vocab_version(aliases)}", digest=digest)
+            df = FRAME_CACHE.get(cache_key)
         
-        # Ensure columns exist
-
-        # Ensure presence of text columns
-        for col in ['post_type', 'post_type_desc', 'designation', 'designation_desc', 'location', 'location_desc']:
-            if col not in df.columns:
-                df[col] = ""
+        if df is None:
+            # Read Excel file once (first sheet, or every sheet stacked), detect headers from the same grid;
+            # parsed serially, since a process pool has no place inside the threaded Streamlit server
+            df = load_posting_workbook(uploaded_file, combine_sheets=combine_sheets, max_workers=1)
+            
+            # Normalize columns
+            df = df.rename(columns={c: aliases.get(snake(c), snake(c)) for c in df.columns})
+            
+            # Parse dates
+            for col in ['date_start', 'date_end']:
+                if col in df.columns:
+                    df[col] = pd.to_datetime(df[col], errors='coerce')
+            
+            # Ensure presence of text columns
+            for col in ['post_type', 'post_type_desc', 'designation', 'designation_desc', 'location', 'location_desc']:
+                if col not in df.columns:
+                    df[col] = ""
+            
+            if cache_key is not None:
+                FRAME_CACHE.put(cache_key, df)
 
         # Force only Designation (Description) to be used, unless empty, then use Designation
-        def get_final_designation(row):
-            desc = str(row.get('designation_desc', '') or '').strip()
-            if desc and desc.lower() not in {"", "nan", "none", "null", "-"}:
-                return desc
-            desig = str(row.get('designation', '') or '').strip()
-            if desig and desig.lower() not in {"", "nan", "none", "null", "-"}:
-                return desig
-            return ''
-
-        df['final_designation'] = df.apply(get_final_designation, axis=1)
+        df['final_designation'] = final_designation(df)
         df['designation'] = df['final_designation']
         df['designation_desc'] = df['final_designation']
         
         # Sort
         if 'date_start' in df.columns and df['date_start'].notna().any():
             df = df.sort_values(by=['date_start', 'date_end'], ascending=[True, True], na_position='last').reset_index(drop=True)
+        else:
+            df = df.reset_index(drop=True)
         
         # Map ranks
-        df['reported_rank'] = (df['post_type'].astype(str) + ' || ' + df.get('post_type_desc', '').astype(str)).apply(map_rank)
-        df['acting_flag'] = df.apply(is_acting, axis=1)
+        df['reported_rank'] = rank_classifier.map_series(df['post_type'].astype(str) + ' || ' + df.get('post_type_desc', '').astype(str))
+        df['acting_flag'] = acting_flags(df, acting_tokens_pattern)
         
         # True rank calculation
-        rows = df.to_dict(orient='records')
+        # Only the two input columns are handed to the resolver; the rest of the frame is untouched
+        df['true_rank'] = resolve_true_ranks(
+            df['reported_rank'].to_numpy(dtype=object),
+            df['acting_flag'].to_numpy(dtype=bool),
+            rank_index,
+        )
         
-        def future_has_lower_than(rows, from_idx, ref_rank):
-            if ref_rank is None:
-                return False
-            ref_idx = rank_index.get(ref_rank, -1)
-            for j in range(from_idx, len(rows)):
-                if bool(rows[j].get('acting_flag')):
-                    continue
-                rj = rows[j].get('reported_rank')
-                if rj is None:
-                    continue
-                if rank_index.get(rj, -1) < ref_idx:
-                    return True
-            return False
-        
-        current_substantive_rank = None
-        for i, r in enumerate(rows):
-            rep = r.get('reported_rank')
-            acting = bool(r.get('acting_flag'))
-            
-            if current_substantive_rank is None:
-                if rep is None:
-                    r['true_rank'] = None
-                else:
-                    looks_acting = acting or future_has_lower_than(rows, i + 1, rep)
-                    if looks_acting:
-                        r['true_rank'] = None
-                    else:
-                        current_substantive_rank = rep
-                        r['true_rank'] = current_substantive_rank
-                continue
-            
-            if rep is None:
-                r['true_rank'] = current_substantive_rank
-                continue
-            
-            if acting:
-                r['true_rank'] = current_substantive_rank
-                continue
-            
-            cur_idx = rank_index.get(current_substantive_rank, -1)
-            rep_idx = rank_index.get(rep, -1)
-            
-            if rep_idx > cur_idx:
-                if future_has_lower_than(rows, i + 1, rep):
-                    r['true_rank'] = current_substantive_rank
-                else:
-                    current_substantive_rank = rep
-                    r['true_rank'] = current_substantive_rank
-            else:
-                r['true_rank'] = current_substantive_rank
-        
-        first_true = next((rr.get('true_rank') for rr in rows if rr.get('true_rank') is not None), None)
-        if first_true is not None:
-            for r in rows:
-                if r.get('true_rank') is None:
-                    r['true_rank'] = first_true
+        # Locations and roles, derived once over the whole frame (before any
+        # helper columns are added, since the location scan reads every column)
+        loc_desc = df['location_desc']
+        loc_series = loc_desc.where(
+            loc_desc.notna() & (loc_desc.astype(str).str.strip() != ''),
+            df['location']
+        ).apply(lambda x: normalize_location(x, STARTER_LOCATION_ALIASES))
         
-        df = pd.DataFrame(rows)
+        # Also search each row for location codes in ANY column
+        row_location_codes = df.apply(lambda row: extract_location_codes_from_row(row, STARTER_LOCATION_INDEX), axis=1)
         
-        # Year ranges by rank
-        segments = []
-        current_rank = None
-        seg_start = None
-        seg_end = None
+        # Prioritize location codes found in row over division column
+        final_location = loc_series.where(row_location_codes == '', row_location_codes)
+        role_list = df.apply(extract_roles_from_row, axis=1)
+        df['final_location'] = final_location
+        df['role_list'] = role_list
         
-        def max_dt(a, b):
-            if pd.isna(a): return b
-            if pd.isna(b): return a
-            return max(a, b)
+        # Year ranges by rank: contiguous true_rank runs become segment ids
+        df['segment_id'], year_ranges = build_rank_segments(df)
         
-        def min_dt(a, b):
-            if pd.isna(a): return b
-            if pd.isna(b): return a
-            return min(a, b)
-        
-        for _, row in df.iterrows():
-            tr = row.get('true_rank')
-            ds = row.get('date_start')
-            de = row.get('date_end')
-            if current_rank is None:
-                current_rank = tr
-                seg_start = ds
-                seg_end = de
-                continue
-            if tr != current_rank:
-                segments.append({'true_rank': current_rank, 'start': seg_start, 'end': seg_end})
-                current_rank = tr
-                seg_start = ds
-                seg_end = de
-            else:
-                seg_start = min_dt(seg_start, ds)
-                seg_end = max_dt(seg_end, de)
-        
-        if current_rank is not None:
-            segments.append({'true_rank': current_rank, 'start': seg_start, 'end': seg_end})
-        
-        def fmt_year_range(start_dt, end_dt):
-            if pd.isna(start_dt) and pd.isna(end_dt):
-                return "Unknown"
-            if pd.isna(start_dt):
-                return f"–{end_dt.year}"
-            sy = start_dt.year
-            if pd.isna(end_dt):
-                return f"{sy}–Present"
-            ey = end_dt.year
-            if ey < sy:
-                return f"{sy}"
-            return f"{sy}–{ey}"
-        
-        year_ranges = [
-            {'true_rank': seg['true_rank'], 'start': seg.get('start'), 'end': seg.get('end'),
-             'year_range': fmt_year_range(seg.get('start'), seg.get('end'))}
-            for seg in segments if seg.get('true_rank') is not None
-        ]
-        
-        # Enhanced ranges with locations and roles
+        # Enhanced ranges with locations and roles: one grouped pass over the frame
+        segment_groups = dict(tuple(df.groupby('segment_id', sort=False)))
         enhanced_ranges = []
         for seg in year_ranges:
             tr = seg['true_rank']
-            start_dt = seg['start']
-            end_dt = seg['end']
-            
-            mask = (df['true_rank'] == tr)
-            if pd.notna(start_dt):
-                mask &= (df['date_start'].isna() | (df['date_start'] >= start_dt))
-            if pd.notna(end_dt):
-                mask &= (df['date_end'].isna() | (df['date_end'] <= end_dt))
-            
-            sub = df.loc[mask].copy()
-            
-            loc_desc = sub['location_desc']
-            loc_series = loc_desc.where(
-                loc_desc.notna() & (loc_desc.astype(str).str.strip() != ''),
-                sub['location']
-            ).apply(lambda x: normalize_location(x, STARTER_LOCATION_ALIASES))
-            
-            # Also search each row for location codes in ANY column
-            row_location_codes = sub.apply(lambda row: extract_location_codes_from_row(row, STARTER_LOCATION_ALIASES), axis=1)
-            
-            # Prioritize location codes found in row over division column
-            loc_series = loc_series.where(row_location_codes == '', row_location_codes)
-            
-            sub['role_list'] = sub.apply(extract_roles_from_row, axis=1)
+            sub = segment_groups.get(seg['segment_id'], df.iloc[0:0])
+            loc_series = sub['final_location']
             
             roles_by_loc = {}
             seen_by_loc = {}
@@ -1023,18 +772,7 @@ def process_excel_file(uploaded_file):
             
             # Remove abbreviations from roles (e.g., "Ach Lia" if "Architectural Liaison" exists)
             for loc in roles_by_loc:
-                roles_list = roles_by_loc[loc]
-                roles_to_remove = set()
-                for i, role1 in enumerate(roles_list):
-                    for j, role2 in enumerate(roles_list):
-                        if i != j:
-                            # Check both directions - role1 could be abbrev of role2 OR vice versa
-                            if is_abbreviation_of(role1, role2):
-                                roles_to_remove.add(role1)
-                            elif is_abbreviation_of(role2, role1):
-                                roles_to_remove.add(role2)
-                # Remove abbreviations, preserving order
-                roles_by_loc[loc] = [r for r in roles_list if r not in roles_to_remove]
+                roles_by_loc[loc] = drop_abbreviations(roles_by_loc[loc])
             
             unique_locs = []
             seen_locs = set()
@@ -1111,18 +849,10 @@ def process_excel_file(uploaded_file):
                         norm_map[key] = r
                 # Remove abbreviations if a full form exists (e.g., 'Cmu Rel' vs 'Community Relations')
                 # If two roles are similar and one is a substring of the other, keep only the longer one
-                final_roles = set(norm_map.values())
-                to_remove = set()
-                for r1 in final_roles:
-                    for r2 in final_roles:
-                        if r1 == r2:
-                            continue
-                        # Remove r1 if it is a substring of r2 (case-insensitive, ignore spaces)
-                        r1_norm = re.sub(r'\s+', '', r1).lower()
-                        r2_norm = re.sub(r'\s+', '', r2).lower()
-                        if r1_norm != r2_norm and r1_norm in r2_norm:
-                            to_remove.add(r1)
-                deduped = [r for r in sorted(final_roles - to_remove)]
+                final_roles = sorted(set(norm_map.values()))
+                # Remove r if it is a substring of another role (case-insensitive, ignore spaces)
+                to_remove = contained_indices(re.sub(r'\s+', '', r).lower() for r in final_roles)
+                deduped = [r for i, r in enumerate(final_roles) if i not in to_remove]
                 # Final aggressive dedup: remove any role that matches (case-insensitive, ignoring spaces) any other role already in the list
                 truly_unique = []
                 seen_norms = set()
@@ -1148,10 +878,20 @@ def process_excel_file(uploaded_file):
     except Exception as e:
         return None, str(e)
 
-def generate_word_document(enhanced_ranges):
-    """Generate Word document with a table format."""
-    doc = Document()
-    
+@st.cache_resource
+def get_doc_template() -> DocxTableTemplate:
+    """Table style, widths and header are built once per server process and cloned per document."""
+    return DocxTableTemplate(
+        header=("Year Range", "Rank", "Posting Location & Roles"),
+        widths=(Inches(1.0), Inches(1.2), Inches(4.3)),  # narrow Year Range and Rank, wide Posting Info
+        style='Light Grid Accent 1',
+        header_fill="ADD8E6",  # Light blue, bold 13pt
+        row_fill="FFFFFF",     # White, 13pt
+        size=Pt(13),
+    )
+
+def generate_word_document(enhanced_ranges) -> bytes:
+    """Generate Word document with a table format; returns the .docx bytes."""
     # Rank expansion mapping with full, official rank names
     rank_full_names = {
         'PC': 'Police Constable',
@@ -1172,35 +912,8 @@ def generate_word_document(enhanced_ranges):
         'CP': 'Commissioner',
     }
     
-    # Helper function to shade cell
-    def shade_cell(cell, color):
-        shading_elm = parse_xml(r'<w:shd {} w:fill="{}"/>'.format(nsdecls('w'), color))
-        cell._element.get_or_add_tcPr().append(shading_elm)
-    
-    # Create table with 3 columns (Year Range, Rank, Posting Info)
-    table = doc.add_table(rows=1, cols=3)
-    table.style = 'Light Grid Accent 1'
-    
-    # Set column widths (narrow for Year Range and Rank, wide for Posting Info)
-    table.columns[0].width = Inches(1.0)  # Year Range - narrow
-    table.columns[1].width = Inches(1.2)  # Rank - narrow
-    table.columns[2].width = Inches(4.3)  # Posting Location & Roles - wide
-    
-    # Add header row
-    header_cells = table.rows[0].cells
-    header_cells[0].text = "Year Range"
-    header_cells[1].text = "Rank"
-    header_cells[2].text = "Posting Location & Roles"
-    
-    # Format header row - bold, size 13, light blue background
-    for cell in header_cells:
-        shade_cell(cell, "ADD8E6")  # Light blue
-        for paragraph in cell.paragraphs:
-            for run in paragraph.runs:
-                run.bold = True
-                run.font.size = Pt(13)
-    
-    # Add data rows
+    # Data rows - white background, size 13 (cloned from the skeleton's row prototype)
+    table_rows = []
     for item in enhanced_ranges:
         year_range = item['year_range']
         rank = item['true_rank']
@@ -1228,19 +941,19 @@ def generate_word_document(enhanced_ranges):
         posting_text = "\n".join(posting_info)
         
         # Add row
-        row_cells = table.add_row().cells
-        row_cells[0].text = year_range
-        row_cells[1].text = rank_display
-        row_cells[2].text = posting_text
-        
-        # Format data rows - white background, size 13
-        for cell in row_cells:
-            shade_cell(cell, "FFFFFF")  # White
-            for paragraph in cell.paragraphs:
-                for run in paragraph.runs:
-                    run.font.size = Pt(13)
-    
-    return doc
+        table_rows.append((year_range, rank_display, posting_text))
+    
+    # The pre-styled skeleton is filled and zipped straight into one bytes object
+    return get_doc_template().render(table_rows)
+
+# ========= RESULT CACHE =========
+# Everything the summary depends on besides the workbook itself
+RESULT_VOCAB_VERSION = vocab_version(ROLE_VOCAB_VERSION, rank_map, STARTER_ROLE_EXPANSIONS, STARTER_LOCATION_ALIASES)
+
+@st.cache_resource
+def get_result_cache() -> ResultCache:
+    """One bounded result cache per server process, shared across sessions and reruns."""
+    return ResultCache(max_entries=32)
 
 # ========= STREAMLIT UI =========
 st.markdown("---")
@@ -1252,42 +965,53 @@ with col1:
 
 if uploaded_file is not None:
     st.success(f"✓ File uploaded: {uploaded_file.name}")
+    combine_sheets = st.checkbox("Combine all sheets", value=False,
+                                 help="Stack every sheet in the workbook instead of reading only the first one")
     
     # Process button
     if st.button("🔄 Process File", use_container_width=True):
-        with st.spinner("Processing your Excel file..."):
-            enhanced_ranges, error = process_excel_file(uploaded_file)
-            
-            if error:
-                st.error(f"Error processing file: {error}")
+        # Same bytes + same vocabulary -> same summary, so repeats skip processing
+        result_cache = get_result_cache()
+        # The upload is hashed once; the frame cache key reuses the same digest
+        digest = content_digest(uploaded_file.getvalue())
+        cache_key = (digest, RESULT_VOCAB_VERSION, combine_sheets)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            enhanced_ranges, docx_bytes = cached
+            error = None
+        else:
+            with st.spinner("Processing your Excel file..."):
+                enhanced_ranges, error = process_excel_file(uploaded_file, combine_sheets=combine_sheets, digest=digest)
+                if not error:
+                    # Generate Word document (already the downloadable bytes)
+                    docx_bytes = generate_word_document(enhanced_ranges)
+                    result_cache.put(cache_key, enhanced_ranges, docx_bytes)
+        
+        if error:
+            st.error(f"Error processing file: {error}")
+        else:
+            if cached is not None:
+                st.success("✓ Processing complete! ⚡ Cached result (this file was already processed)")
             else:
                 st.success("✓ Processing complete!")
-                
-                # Generate Word document
-                doc = generate_word_document(enhanced_ranges)
-                
-                # Create downloadable file
-                doc_bytes = io.BytesIO()
-                doc.save(doc_bytes)
-                doc_bytes.seek(0)
-                
-                # Download button
-                st.download_button(
-                    label="📥 Download Word Document",
-                    data=doc_bytes.getvalue(),
-                    file_name="HKPF_Posting_Summary.docx",
-                    mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                    use_container_width=True
-                )
-                
-                # Show preview
-                with st.expander("📋 Preview Summary"):
-                    for item in enhanced_ranges:
-                        st.write(f"**{item['true_rank']}: {item['year_range']}**")
-                        for loc in item['locations']:
-                            st.write(f"  • {loc}")
-                            roles = item['roles_by_location'].get(loc, [])
-                            for role in roles:
-                                st.write(f"    - {role}")
+            
+            # Download button
+            st.download_button(
+                label="📥 Download Word Document",
+                data=docx_bytes,
+                file_name="HKPF_Posting_Summary.docx",
+                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                use_container_width=True
+            )
+            
+            # Show preview
+            with st.expander("📋 Preview Summary"):
+                for item in enhanced_ranges:
+                    st.write(f"**{item['true_rank']}: {item['year_range']}**")
+                    for loc in item['locations']:
+                        st.write(f"  • {loc}")
+                        roles = item['roles_by_location'].get(loc, [])
+                        for role in roles:
+                            st.write(f"    - {role}")
 else:
     st.info("👆 Please upload an Excel file to get started")